@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+"""Measure the overhead of optimize_later instrumentation itself.
+
+Usage:
+    python benchmarks/overhead.py [--json] [--output FILE] [--compare FILE] [--filter SUBSTRING] [--check]
+
+Results are the best per-call time in nanoseconds over several repeats. With --json or --output, they are
+written as JSON, which can later be passed to --compare to spot overhead regressions between versions.
+With --check, the exit status is 1 if a benchmark makes more calls than allowed by CHECKS.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from optimize_later import config  # noqa: E402
+from optimize_later.config import optimize_context  # noqa: E402
+from optimize_later.core import optimize_later  # noqa: E402
+from optimize_later.routing import CallbackList  # noqa: E402
+from optimize_later.sampling import RandomSampler  # noqa: E402
+
+INF = float('inf')
+
+
+def noop(*args, **kwargs):
+    pass
+
+
+def bench_baseline_call():
+    return noop
+
+
+def bench_with_named():
+    def run():
+        with optimize_later('name', INF):
+            pass
+    return run
+
+
+def bench_with_unnamed():
+    def run():
+        with optimize_later(INF):
+            pass
+    return run
+
+
+def bench_with_unsampled():
+    sampler = RandomSampler(0)
+
+    def run():
+        with optimize_later('name', INF, sampler=sampler):
+            pass
+    return run
+
+
+def bench_decorator():
+    return optimize_later('name', INF)(noop)
+
+
+def bench_decorator_unnamed():
+    return optimize_later(INF)(noop)
+
+
+def bench_decorator_unsampled():
+    return optimize_later('name', INF, sampler=RandomSampler(0))(noop)
+
+
+def make_bench_blocks(depth, width):
+    def nest(parent, level):
+        for i in range(width):
+            with parent.block('block') as block:
+                if level < depth:
+                    nest(block, level + 1)
+
+    def bench():
+        def run():
+            with optimize_later('name', INF) as o:
+                nest(o, 1)
+        return run
+    return bench
+
+
+def bench_optimize_context():
+    def run():
+        with optimize_context():
+            pass
+    return run
+
+
+def make_bench_callbacks(count):
+    def bench():
+        callbacks = [noop] * count
+
+        def run():
+            with optimize_context(callbacks, reset=True):
+                with optimize_later('name'):
+                    pass
+        return run
+    return bench
+
+
+BENCHMARKS = [
+    ('baseline_call', bench_baseline_call),
+    ('with_named', bench_with_named),
+    ('with_unnamed', bench_with_unnamed),
+    ('with_unsampled', bench_with_unsampled),
+    ('decorator', bench_decorator),
+    ('decorator_unnamed', bench_decorator_unnamed),
+    ('decorator_unsampled', bench_decorator_unsampled),
+    ('optimize_context', bench_optimize_context),
+]
+for depth, width in ((1, 1), (1, 10), (1, 100), (3, 3), (10, 1)):
+    BENCHMARKS.append(('blocks_depth%d_width%d' % (depth, width), make_bench_blocks(depth, width)))
+for count in (0, 1, 10, 100):
+    BENCHMARKS.append(('callbacks_%d' % (count,), make_bench_callbacks(count)))
+
+# (benchmark, maximum Python-level calls per run), which unlike times do not depend on the machine. A with
+# statement skipped by sampling should only build the optimize_later, enter it, call the sampler and exit it.
+CHECKS = [
+    ('with_unsampled', 4),
+]
+
+
+def autorange(timer):
+    # Timer.autorange() is missing before Python 3.6: find a number of loops in 1, 2, 5, 10, 20, 50, ... taking
+    # at least 0.2s.
+    base = 1
+    while True:
+        for multiplier in (1, 2, 5):
+            number = base * multiplier
+            if timer.timeit(number) >= 0.2:
+                return number
+        base *= 10
+
+
+def measure(function, repeat):
+    timer = timeit.Timer(function)
+    number = autorange(timer)
+    return min(timer.repeat(repeat, number)) / number * 1e9
+
+
+def count_calls(function):
+    calls = []
+
+    def profile(frame, event, arg):
+        if event == 'call':
+            calls.append(frame.f_code)
+
+    sys.setprofile(profile)
+    try:
+        function()
+    finally:
+        sys.setprofile(None)
+    # Not counting function itself.
+    return len(calls) - 1
+
+
+def check():
+    benchmarks = dict(BENCHMARKS)
+    passed = True
+    for name, limit in CHECKS:
+        function = benchmarks[name]()
+        # The first run may set up caches.
+        function()
+        calls = count_calls(function)
+        if calls > limit:
+            print('%s made %d Python-level calls, over %d' % (name, calls, limit), file=sys.stderr)
+            passed = False
+    return passed
+
+
+def get_version():
+    try:
+        from importlib.metadata import version
+        return version('optimize-later')
+    except Exception:
+        return 'unknown'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the overhead of optimize_later.')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--output', help='write JSON results to this file')
+    parser.add_argument('--compare', help='compare with JSON results from a previous run')
+    parser.add_argument('--filter', help='only run benchmarks whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--check', action='store_true',
+                        help='fail if a benchmark makes more calls than allowed by CHECKS')
+    args = parser.parse_args(argv)
+
+    # Run with no global callbacks, so that only the instrumentation itself is measured.
+    config._global_callbacks = CallbackList()
+
+    results = {}
+    for name, bench in BENCHMARKS:
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = measure(bench(), args.repeat)
+        if not args.json:
+            print('%-28s %12.1f ns' % (name, results[name]), file=sys.stderr if args.compare else sys.stdout)
+
+    data = {
+        'version': get_version(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'unit': 'ns',
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+    if args.json:
+        print(json.dumps(data, indent=2, sort_keys=True))
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)['results']
+        print('%-28s %12s %12s %8s' % ('benchmark', 'old (ns)', 'new (ns)', 'change'))
+        for name, value in results.items():
+            if name in old:
+                print('%-28s %12.1f %12.1f %+7.1f%%' % (name, old[name], value, (value / old[name] - 1) * 100))
+
+    if args.check and not check():
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""Analyze reports written by optimize_later.jsonl.JSONLinesSink.
+
+Usage: python -m optimize_later [--top N] FILE...
+"""
+import argparse
+import sys
+
+from optimize_later.jsonl import open_reports
+from optimize_later.stats import LatencyHistogram
+
+
+class ReportAnalysis(object):
+    """Aggregates a stream of reports with memory bounded by the number of distinct block names.
+
+    Batches, e.g. from OPTIMIZE_LATER_BATCH_REQUESTS, are counted as the reports in them.
+    """
+
+    def __init__(self):
+        self.reports = 0
+        self.histograms = {}
+        self.overage = {}
+        self.blocks = {}
+
+    def add(self, report):
+        if 'reports' in report:
+            for child in report['reports']:
+                self.add(child)
+            return
+        name = report['name']
+        self.reports += 1
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram()
+        histogram.record(report['delta'])
+        self.overage[name] = self.overage.get(name, 0) + max(report['delta'] - (report['limit'] or 0), 0)
+        self._add_blocks(name, report.get('blocks') or ())
+
+    def _add_blocks(self, path, blocks):
+        for block in blocks:
+            block_path = '%s > %s' % (path, block['name'])
+            if block.get('delta') is not None:
+                count, total = self.blocks.get(block_path, (0, 0))
+                self.blocks[block_path] = (count + 1, total + block['delta'])
+            self._add_blocks(block_path, block.get('blocks') or ())
+
+    def format(self, top=10):
+        lines = ['%d reports, %d block names' % (self.reports, len(self.histograms)),
+                 '', 'Top offenders by total time over limit:']
+        for name, overage in sorted(self.overage.items(), key=lambda item: -item[1])[:top]:
+            lines.append('  %10.6fs  %6d reports  %s' % (overage, self.histograms[name].count, name))
+
+        lines += ['', 'Percentiles by name:',
+                  '  %-40s %8s %10s %10s %10s %10s' % ('name', 'count', 'p50', 'p90', 'p99', 'max')]
+        for name, histogram in sorted(self.histograms.items(), key=lambda item: -item[1].count)[:top]:
+            lines.append('  %-40s %8d %10.6f %10.6f %10.6f %10.6f' % (
+                name, histogram.count, histogram.percentile(50), histogram.percentile(90),
+                histogram.percentile(99), histogram.max,
+            ))
+
+        lines += ['', 'Most expensive child blocks:']
+        for path, (count, total) in sorted(self.blocks.items(), key=lambda item: -item[1][1])[:top]:
+            lines.append('  %10.6fs  %6d times  %s' % (total, count, path))
+        return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m optimize_later', description=__doc__.splitlines()[0])
+    parser.add_argument('files', nargs='+', metavar='FILE', help='JSON lines files, optionally gzipped')
+    parser.add_argument('--top', type=int, default=10, help='number of entries to show in each section')
+    args = parser.parse_args(argv)
+
+    analysis = ReportAnalysis()
+    for path in args.files:
+        skipped = []
+        for report in open_reports(path, skipped):
+            analysis.add(report)
+        if skipped:
+            print('%s: skipped %d malformed line%s' % (path, len(skipped), '' if len(skipped) == 1 else 's'),
+                  file=sys.stderr)
+    print(analysis.format(args.top))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
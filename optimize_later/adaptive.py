@@ -0,0 +1,115 @@
+import json
+
+from optimize_later.stats import LatencyHistogram
+
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
+
+class Baseline(object):
+    """Rolling latency statistics of a single block name, over the last one to two windows."""
+
+    __slots__ = ('current', 'previous', 'limit', 'pending')
+
+    def __init__(self, previous=None):
+        self.current = LatencyHistogram()
+        self.previous = previous
+        self.limit = None
+        self.pending = 0
+
+    @property
+    def count(self):
+        return self.current.count + (self.previous.count if self.previous is not None else 0)
+
+    def histogram(self):
+        histogram = self.current.copy()
+        if self.previous is not None:
+            histogram.merge(self.previous)
+        return histogram
+
+
+class AdaptiveLimit(object):
+    """A limit derived from each block's own history: percentile of recent runs times factor.
+
+    Pass an instance as the limit of optimize_later. A single instance can be shared by many blocks,
+    as baselines are kept per block name. Until a name has seen `warmup` runs, `ceiling` is used as
+    the limit, or nothing is reported if there is no ceiling.
+    """
+
+    def __init__(self, percentile=99, factor=1.5, warmup=100, floor=0, ceiling=None, window=10000,
+                 recompute_every=100):
+        self.percentile = percentile
+        self.factor = factor
+        self.warmup = warmup
+        self.floor = floor
+        self.ceiling = ceiling
+        self.window = window
+        self.recompute_every = recompute_every
+        self._baselines = {}
+        self._lock = threading.Lock()
+
+    def _compute(self, baseline):
+        if baseline.count < self.warmup:
+            return self.ceiling
+        limit = max(baseline.histogram().percentile(self.percentile) * self.factor, self.floor)
+        if self.ceiling is not None:
+            limit = min(limit, self.ceiling)
+        return limit
+
+    def observe(self, name, delta):
+        """Record a run, returning the limit it should be judged against, or None to not report it."""
+        with self._lock:
+            baseline = self._baselines.get(name)
+            if baseline is None:
+                baseline = self._baselines[name] = Baseline()
+                baseline.limit = self.ceiling
+
+            limit = baseline.limit
+            baseline.current.record(delta)
+            baseline.pending += 1
+            if baseline.current.count >= self.window:
+                baseline.previous, baseline.current = baseline.current, LatencyHistogram()
+            if baseline.pending >= self.recompute_every or baseline.count <= self.warmup:
+                baseline.limit = self._compute(baseline)
+                baseline.pending = 0
+        return limit
+
+    def get_limit(self, name):
+        baseline = self._baselines.get(name)
+        return None if baseline is None else baseline.limit
+
+    def baselines(self):
+        """Return a dictionary of the learned state for every block name, for inspection."""
+        with self._lock:
+            items = list(self._baselines.items())
+        result = {}
+        for name, baseline in items:
+            histogram = baseline.histogram()
+            result[name] = {
+                'count': histogram.count,
+                'limit': baseline.limit,
+                'mean': histogram.mean,
+                'percentile': histogram.percentile(self.percentile),
+                'max': histogram.max,
+            }
+        return result
+
+    def dump(self):
+        with self._lock:
+            return {name: baseline.histogram().to_dict() for name, baseline in self._baselines.items()}
+
+    def load(self, data):
+        with self._lock:
+            for name, histogram in data.items():
+                baseline = self._baselines[name] = Baseline(LatencyHistogram.from_dict(histogram))
+                baseline.limit = self._compute(baseline)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.dump(), f)
+
+    def restore(self, path):
+        with open(path) as f:
+            self.load(json.load(f))
@@ -5,11 +5,15 @@ from django.apps import AppConfig
 from django.conf import settings
 from django.utils.module_loading import import_string
 
-from optimize_later import config
+from optimize_later import config, overrides
+from optimize_later.dispatch import AsyncDispatcher
+from optimize_later.routing import CallbackList, RoutedCallback, get_index
 
 log = logging.getLogger(__name__.rpartition('.')[0] or __name__)
 
-django_callbacks = []
+django_callbacks = CallbackList()
+django_dispatcher = None
+django_config_watcher = None
 
 
 class OptimizeLaterConfig(AppConfig):
@@ -18,10 +22,18 @@ class OptimizeLaterConfig(AppConfig):
 
     def ready(self):
         initialize_django_callbacks()
+        initialize_django_overrides()
 
 
 def django_callback(result):
-    for callback in django_callbacks:
+    if django_dispatcher is not None:
+        django_dispatcher(result)
+    else:
+        invoke_django_callbacks(result)
+
+
+def invoke_django_callbacks(result):
+    for callback in get_index(django_callbacks).route(result):
         try:
             callback(result)
         except Exception:
@@ -29,9 +41,30 @@ def django_callback(result):
 
 
 def initialize_django_callbacks():
-    global django_callbacks
-    django_callbacks = []
+    global django_callbacks, django_dispatcher
+    django_callbacks = CallbackList()
     for callback in getattr(settings, 'OPTIMIZE_LATER_CALLBACKS', None) or []:
-        django_callbacks.append(import_string(callback))
+        if isinstance(callback, dict):
+            django_callbacks.append(RoutedCallback(import_string(callback['callback']), callback.get('pattern'),
+                                                   callback.get('min_overage')))
+        else:
+            django_callbacks.append(import_string(callback))
+
+    if django_dispatcher is not None:
+        django_dispatcher.close()
+        django_dispatcher = None
+
+    options = getattr(settings, 'OPTIMIZE_LATER_ASYNC', None)
+    if options:
+        django_dispatcher = AsyncDispatcher(invoke_django_callbacks, **(options if isinstance(options, dict) else {}))
+
+
+def initialize_django_overrides():
+    global django_config_watcher
+    if django_config_watcher is not None:
+        django_config_watcher.stop()
+    # Falls back to the OPTIMIZE_LATER_CONFIG environment variable.
+    django_config_watcher = overrides.configure(getattr(settings, 'OPTIMIZE_LATER_CONFIG', None),
+                                                getattr(settings, 'OPTIMIZE_LATER_CONFIG_INTERVAL', 5))
 
 config.register_callback(django_callback)
@@ -0,0 +1,89 @@
+import logging
+from time import perf_counter
+
+from optimize_later.config import get_callbacks, global_callback, optimize_context
+
+log = logging.getLogger(__name__.rpartition('.')[0] or __name__)
+
+
+class ReportBatch(object):
+    """Every report made during one unit of work, e.g. a request, dispatched to callbacks as one.
+
+    It has the name, limit, start, end and delta of the unit of work, so that callbacks can treat it like a
+    report, and the reports themselves in report.reports. Annotations, such as the request path and method,
+    are in report.annotations.
+    """
+
+    def __init__(self, name, limit, start, end, reports, annotations=None):
+        self.name = name
+        self.limit = limit
+        self.start = start
+        self.end = end
+        self.delta = end - start
+        self.reports = reports
+        self.annotations = annotations or {}
+
+    def to_dict(self):
+        result = {
+            'name': self.name, 'limit': self.limit, 'start': self.start, 'end': self.end, 'delta': self.delta,
+            'reports': [report.to_dict() for report in self.reports],
+        }
+        # Nested, so that annotations cannot replace the fields above.
+        if self.annotations:
+            result['annotations'] = dict(self.annotations)
+        return result
+
+    def short(self, precision=3):
+        return 'Batch %r%s took %.*fs, with %d slow report%s' % (
+            self.name, ''.join(' %s=%s' % item for item in sorted(self.annotations.items())),
+            precision, self.delta, len(self.reports), '' if len(self.reports) == 1 else 's',
+        )
+
+    def long(self, precision=6):
+        lines = [self.short(precision) + ':']
+        for report in self.reports:
+            lines.append('  ' + report.long(precision).replace('\n', '\n  '))
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.short()
+
+
+class batch_reports(object):
+    """Collects every report made inside the with statement, and dispatches them as one ReportBatch on exit.
+
+    The batch goes to callback if given, or else to the callbacks active when entering. Nothing is dispatched
+    if no reports were made. Annotations are keyword arguments, and can be added to self.annotations before
+    exit, as can the name and limit.
+    """
+
+    def __init__(self, name, limit=None, callback=None, **annotations):
+        self.name = name
+        self.limit = limit
+        self.callback = callback
+        self.annotations = annotations
+        self.reports = []
+        self.start = None
+        self._callbacks = None
+        self._context = None
+
+    def __enter__(self):
+        self._callbacks = get_callbacks()
+        self._context = optimize_context([self.reports.append], reset=True)
+        self._context.__enter__()
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        end = perf_counter()
+        self._context.__exit__(exc_type, exc_val, exc_tb)
+        if not self.reports:
+            return
+        batch = ReportBatch(self.name, self.limit, self.start, end, self.reports, self.annotations)
+        if self.callback is not None:
+            try:
+                self.callback(batch)
+            except Exception:
+                log.exception('Failed to invoke user-specified callback: %r', self.callback)
+        else:
+            global_callback(batch, self._callbacks)
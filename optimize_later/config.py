@@ -1,6 +1,8 @@
 import logging
 from functools import wraps
+from inspect import iscoroutinefunction
 
+from optimize_later.routing import CallbackList, RoutedCallback, get_index
 from optimize_later.utils import NoArgDecoratorMeta, with_metaclass
 
 try:
@@ -8,30 +10,179 @@ try:
 except ImportError:
     import dummy_threading as threading
 
+try:
+    from contextvars import ContextVar
+except ImportError:
+    ContextVar = None
+
 log = logging.getLogger(__name__.rpartition('.')[0] or __name__)
 
-_global_callbacks = []
-_local = threading.local()
+_global_callbacks = CallbackList()
+_recorders = []
+_throttle = None
+_sampler = None
+_watchdog = None
+_profiler = None
+_nesting = False
+_enabled = True
+_overrides = None
 
+# Whether features are enabled that decorated functions cannot skip with their fast path.
+_full_path = False
 
-def get_callbacks():
-    try:
-        return _local.callbacks
-    except AttributeError:
-        return _global_callbacks
+# Context variables keep asyncio tasks sharing a thread isolated from each other.
+if ContextVar is not None:
+    _context = ContextVar('optimize_later_callbacks', default=None)
+    _get_context = _context.get
+    _set_context = _context.set
+
+    _active = ContextVar('optimize_later_active', default=None)
+    get_active = _active.get
+    set_active = _active.set
+else:
+    _local = threading.local()
+
+    def _get_context():
+        return getattr(_local, 'callbacks', None)
+
+    def _set_context(callbacks):
+        _local.callbacks = callbacks
 
+    def get_active():
+        return getattr(_local, 'active', None)
 
-def register_callback(callback):
-    get_callbacks().append(callback)
+    def set_active(block):
+        _local.active = block
+
+
+def get_callbacks():
+    callbacks = _get_context()
+    return _global_callbacks if callbacks is None else callbacks
+
+
+def register_callback(callback=None, pattern=None, min_overage=None):
+    """Register callback(report) for slow reports in the current context.
+
+    With pattern, only reports whose name matches the glob pattern are passed, and with min_overage, only
+    those over their limit by at least that many seconds. Without callback, returns a decorator.
+    """
+    if callback is None:
+        return lambda callback: register_callback(callback, pattern, min_overage)
+    if pattern is None and min_overage is None:
+        get_callbacks().append(callback)
+    else:
+        get_callbacks().append(RoutedCallback(callback, pattern, min_overage))
     return callback
 
 
 def deregister_callback(callback):
-    get_callbacks().remove(callback)
+    callbacks = get_callbacks()
+    for index, registered in enumerate(callbacks):
+        if registered == callback or isinstance(registered, RoutedCallback) and registered.callback == callback:
+            del callbacks[index]
+            return
+    raise ValueError('Callback not registered: %r' % (callback,))
+
+
+def register_recorder(recorder):
+    """Register recorder(name, delta) to be invoked on every exit, whether or not the limit is exceeded."""
+    _recorders.append(recorder)
+    return recorder
+
+
+def deregister_recorder(recorder):
+    _recorders.remove(recorder)
 
 
-def global_callback(report):
-    for callback in get_callbacks():
+def record(name, delta):
+    for recorder in _recorders:
+        try:
+            recorder(name, delta)
+        except Exception:
+            log.exception('Failed to invoke recorder: %r', recorder)
+
+
+def set_throttle(throttle):
+    """Throttle slow reports by block name, e.g. set_throttle(TokenBucketThrottle(1, burst=5)). None disables."""
+    global _throttle
+    _throttle = throttle
+
+
+def get_throttle():
+    return _throttle
+
+
+def set_sampler(sampler):
+    """Only time entries for which sampler() is true, e.g. set_sampler(CountingSampler(100)). None disables."""
+    global _sampler
+    _sampler = sampler
+
+
+def get_sampler():
+    return _sampler
+
+
+def _update_full_path():
+    global _full_path
+    _full_path = _watchdog is not None or _profiler is not None or _nesting or _overrides is not None
+
+
+def set_watchdog(watchdog):
+    """Report blocks still running past their limit, e.g. set_watchdog(Watchdog()). None disables."""
+    global _watchdog
+    _watchdog = watchdog
+    _update_full_path()
+
+
+def get_watchdog():
+    return _watchdog
+
+
+def set_profiler(profiler):
+    """Sample the stacks of blocks running past their limit, e.g. set_profiler(StackProfiler()). None disables."""
+    global _profiler
+    _profiler = profiler
+    _update_full_path()
+
+
+def get_profiler():
+    return _profiler
+
+
+def set_nesting(enabled):
+    """When enabled, optimize_later entered inside another becomes its child block instead of reporting."""
+    global _nesting
+    _nesting = enabled
+    _update_full_path()
+
+
+def get_nesting():
+    return _nesting
+
+
+def set_enabled(enabled):
+    """Turn all timing on or off. While off, optimize_later does nothing beyond checking this flag."""
+    global _enabled
+    _enabled = enabled
+
+
+def get_enabled():
+    return _enabled
+
+
+def set_overrides(overrides):
+    """Override limits, sampling and callbacks by block name, e.g. set_overrides(Overrides({...})). None disables."""
+    global _overrides
+    _overrides = overrides
+    _update_full_path()
+
+
+def get_overrides():
+    return _overrides
+
+
+def global_callback(report, callbacks=None):
+    for callback in get_index(get_callbacks() if callbacks is None else callbacks).route(report):
         try:
             callback(report)
         except Exception:
@@ -44,10 +195,7 @@ class optimize_context(with_metaclass(NoArgDecoratorMeta)):
         self.reset = reset
 
     def __enter__(self):
-        try:
-            self.old_context = _local.callbacks
-        except AttributeError:
-            self.old_context = None
+        self.old_context = _get_context()
 
         if self.reset:
             base_context = []
@@ -55,17 +203,26 @@ class optimize_context(with_metaclass(NoArgDecoratorMeta)):
             base_context = _global_callbacks
         else:
             base_context = self.old_context
-        _local.callbacks = base_context + self.callbacks
+        _set_context(CallbackList(base_context + self.callbacks))
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.old_context is None:
-            del _local.callbacks
-        else:
-            _local.callbacks = self.old_context
+        _set_context(self.old_context)
+
+    async def __aenter__(self):
+        self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.__exit__(exc_type, exc_val, exc_tb)
 
     def __call__(self, function):
-        @wraps(function)
-        def wrapper(*args, **kwargs):
-            with optimize_context(self.callbacks, reset=self.reset):
-                return function(*args, **kwargs)
+        if iscoroutinefunction(function):
+            @wraps(function)
+            async def wrapper(*args, **kwargs):
+                with optimize_context(self.callbacks, reset=self.reset):
+                    return await function(*args, **kwargs)
+        else:
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with optimize_context(self.callbacks, reset=self.reset):
+                    return function(*args, **kwargs)
         return wrapper
@@ -1,81 +1,268 @@
-import inspect
 import logging
 import os
+import sys
+import traceback
 from copy import copy
 from functools import wraps
+from inspect import iscoroutinefunction, isgeneratorfunction
 from numbers import Number
+from threading import get_ident
 from time import perf_counter
+from types import FunctionType
 
-from optimize_later.config import global_callback
-from optimize_later.utils import NoArgDecoratorMeta, with_metaclass
+from optimize_later import config
+from optimize_later.adaptive import AdaptiveLimit
+from optimize_later.config import global_callback, get_active, get_callbacks, get_nesting, get_profiler, \
+    get_sampler, get_throttle, get_watchdog, record, set_active, _recorders
+from optimize_later.generators import TimedAsyncGenerator, TimedGenerator
+from optimize_later.measure import Measurements, measure_flags
+from optimize_later.profiler import format_collapsed
 from optimize_later import utils
 
+try:
+    from inspect import isasyncgenfunction
+except ImportError:
+    # Asynchronous generators were added in Python 3.6.
+    isasyncgenfunction = None
+
 log = logging.getLogger(__name__.rpartition('.')[0] or __name__)
 
 
+# Marks blocks that did not make themselves the active block, as None means there was no active block.
+_not_active = object()
+
+_internal_files = {__file__, utils.__file__}
+_decoratable = (FunctionType, staticmethod, classmethod)
+_name_cache = {}
+_name_cache_size = 4096
+
+
 def _generate_default_name():
-    for entry in inspect.stack():
-        file, line = entry[1:3]
-        if file not in (__file__, utils.__file__):
-            break
-    else:
+    # Walk raw frames instead of inspect.stack(), which reads source lines from disk for the whole stack.
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_code.co_filename in _internal_files:
+        frame = frame.f_back
+    if frame is None:
         return '-'
-    return '%s@%d' % (os.path.basename(file), line)
+
+    key = frame.f_code, frame.f_lineno
+    try:
+        return _name_cache[key]
+    except KeyError:
+        if len(_name_cache) >= _name_cache_size:
+            _name_cache.clear()
+        name = _name_cache[key] = '%s@%d' % (os.path.basename(frame.f_code.co_filename), frame.f_lineno)
+        return name
+
+
+class MeasuredMixin(object):
+    __slots__ = ()
+
+    @property
+    def cpu_time(self):
+        return self._measurements.cpu if self._measurements is not None else None
+
+    @property
+    def gc_time(self):
+        return self._measurements.gc if self._measurements is not None else None
+
+    @property
+    def memory(self):
+        return self._measurements.memory if self._measurements is not None else None
+
+    def _measurements_suffix(self, precision):
+        if self._measurements is None or self.end is None:
+            return ''
+        return ' (%s)' % (self._measurements.format(precision),)
 
 
-class OptimizeBlock(object):
-    def __init__(self, name):
+class OptimizeBlock(MeasuredMixin):
+    # Blocks can be created thousands of times per report, so keep them small.
+    __slots__ = ('name', 'start', 'end', '_blocks', '_measurements', '_previous_active')
+
+    def __init__(self, name, measure=0):
         self.name = name
         self.start = None
         self.end = None
-        self.delta = None
-        self.blocks = []
+        self._blocks = None
+        self._measurements = Measurements(measure) if measure else None
+        self._previous_active = _not_active
+
+    @property
+    def delta(self):
+        if self.end is None:
+            return None
+        return self.end - self.start
+
+    @property
+    def blocks(self):
+        if self._blocks is None:
+            self._blocks = []
+        return self._blocks
 
     def block(self, name=None):
-        block = OptimizeBlock(name or _generate_default_name())
-        self.blocks.append(block)
+        block = OptimizeBlock(name or _generate_default_name(),
+                              self._measurements.flags if self._measurements is not None else 0)
+        if self._blocks is None:
+            self._blocks = [block]
+        else:
+            self._blocks.append(block)
+        return block
+
+    def snapshot(self):
+        """Copy this block and its children, so that the copy is not affected by blocks still running."""
+        block = copy(self)
+        if self._measurements is not None:
+            block._measurements = copy(self._measurements)
+        if self._blocks is not None:
+            block._blocks = [child.snapshot() for child in self._blocks]
         return block
 
     def __enter__(self):
         assert self.start is None, 'Do not reuse blocks.'
+        if get_nesting():
+            self._previous_active = get_active()
+            set_active(self)
+        if self._measurements is not None:
+            self._measurements.start()
         self.start = perf_counter()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.end = perf_counter()
-        self.delta = self.end - self.start
+        if self._measurements is not None:
+            self._measurements.stop()
+        if self._previous_active is not _not_active:
+            set_active(self._previous_active)
+            self._previous_active = _not_active
 
     def short(self, precision=3):
-        return 'Block %r took %.*fs' % (self.name, precision, self.delta)
+        if self.end is None:
+            return 'Block %r still running' % (self.name,)
+        return 'Block %r took %.*fs%s' % (self.name, precision, self.delta, self._measurements_suffix(precision))
 
     def long(self, precision=6):
-        lines = ['  - %s%s' % (self.short(precision), ', children:' if self.blocks else '')]
-        for block in self.blocks:
+        lines = ['  - %s%s' % (self.short(precision), ', children:' if self._blocks else '')]
+        for block in self._blocks or ():
             lines.append('    ' + block.long().replace('\n', '\n    '))
         return '\n'.join(lines)
 
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a block and its children from to_dict(), e.g. after timing it in another process."""
+        block = cls(data['name'])
+        block.start, block.end = data['start'], data['end']
+        if data.get('blocks'):
+            block._blocks = [cls.from_dict(child) for child in data['blocks']]
+        if 'cpu_time' in data or 'gc_time' in data or 'memory' in data:
+            block._measurements = Measurements.from_dict(data)
+        return block
+
+    def to_dict(self):
+        result = {'name': self.name, 'start': self.start, 'end': self.end, 'delta': self.delta}
+        if self._measurements is not None and self.end is not None:
+            result.update(self._measurements.to_dict())
+        if self._blocks:
+            result['blocks'] = [block.to_dict() for block in self._blocks]
+        return result
+
     def __str__(self):
-        return 'Block %r took %.6fs' % (self.name, self.delta)
+        return self.short(6)
 
     def __repr__(self):
         return 'optimize_block(%r, delta=%.6f, blocks=%r)' % (self.name, self.delta, self.blocks)
 
 
-class OptimizeReport(object):
-    def __init__(self, name, limit, start, end, delta, blocks):
+class _NullBlock(object):
+    name = '-'
+    start = end = delta = None
+    blocks = ()
+
+    def block(self, name=None):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+# Returned by block() on entries skipped by sampling.
+_null_block = _NullBlock()
+
+
+class OptimizeReport(MeasuredMixin):
+    def __init__(self, name, limit, start, end, delta, blocks, suppressed=0, sample_rate=1.0, stack=None,
+                 in_progress_report=None, stacks=None, measurements=None, generator=None, thread=None):
         self.name = name
         self.limit = limit
         self.start = start
         self.end = end
         self.delta = delta
         self.blocks = blocks
+        self.suppressed = suppressed
+        self.sample_rate = sample_rate
+
+        # Set on reports made by the watchdog while the block is still running.
+        self.stack = stack
+
+        # Set on completion reports of blocks that the watchdog reported while still running.
+        self.in_progress_report = in_progress_report
+
+        # Collapsed stacks sampled by the profiler: {'file.py:outer;file.py:inner': samples}.
+        self.stacks = stacks
+
+        # CPU time, GC time and allocations, if requested, exposed as cpu_time, gc_time and memory.
+        self._measurements = measurements
+
+        # GeneratorStats for timed generators, whose delta is the time spent producing items.
+        self.generator = generator
+
+        # The threading.get_ident() of the thread that ran the block.
+        self.thread = thread
+
+    def collapsed(self):
+        return format_collapsed(self.stacks or {})
+
+    def to_dict(self):
+        result = {
+            'name': self.name, 'limit': self.limit, 'start': self.start, 'end': self.end, 'delta': self.delta,
+            'blocks': [block.to_dict() for block in self.blocks],
+        }
+        if self.suppressed:
+            result['suppressed'] = self.suppressed
+        if self.sample_rate != 1:
+            result['sample_rate'] = self.sample_rate
+        if self.stack:
+            result['stack'] = self.stack
+        if self.stacks:
+            result['stacks'] = self.stacks
+        if self._measurements is not None and self.end is not None:
+            result.update(self._measurements.to_dict())
+        if self.generator is not None:
+            result['generator'] = self.generator.to_dict()
+        if self.thread is not None:
+            result['thread'] = self.thread
+        return result
+
+    @property
+    def in_progress(self):
+        return self.end is None
 
     def short(self, precision=3):
-        return 'Block %r took %.*fs (+%.*fs over limit)' % (
+        result = 'Block %r %s %.*fs (+%.*fs over limit)' % (
             self.name,
+            'still running after' if self.in_progress else 'took',
             precision, self.delta,
             precision, self.delta - self.limit,
         )
+        result += self._measurements_suffix(precision)
+        if self.generator is not None:
+            result += ', %s' % (self.generator.format(precision),)
+        if self.suppressed:
+            result += ' [%d similar reports suppressed]' % (self.suppressed,)
+        return result
 
     def long(self, precision=6):
         lines = [self.short(precision)]
@@ -83,62 +270,370 @@ class OptimizeReport(object):
             lines[-1] += ', children:'
             for block in self.blocks:
                 lines.append(block.long())
+        if self.stack:
+            lines.append('Stack:')
+            lines.append(''.join(self.stack).rstrip('\n'))
         return '\n'.join(lines)
 
     def __str__(self):
         return self.short()
 
 
-class optimize_later(with_metaclass(NoArgDecoratorMeta)):
-    def __init__(self, name=None, limit=None, callback=None):
+class optimize_later(object):
+    # An instance is built on every with statement, sampled or not, so attributes only set once timing starts
+    # default to these class attributes instead of being assigned in __new__.
+    adaptive = None
+    start = end = delta = None
+    _measurements = None
+
+    # The rule from config.set_overrides() matching this name, resolved on entry.
+    _rule = None
+
+    # Set by rename() when the rule for the new name disables or samples out a running entry.
+    _discarded = False
+
+    _watchdog = _watchdog_timer = None
+    _profiler = _profile = None
+
+    # With nesting enabled, the block this became in the enclosing optimize_later or block.
+    _nested = None
+    _previous_active = _not_active
+    in_progress_report = None
+    generator = None
+
+    # This is going to get shallow copied, so we shouldn't use [].
+    blocks = None
+
+    def __new__(cls, name=None, limit=None, callback=None, sampler=None, cpu=False, gc=False, memory=False):
+        # Set up here rather than in __init__ under NoArgDecoratorMeta, as each Python-level call is a noticeable
+        # share of an unsampled entry.
+        if limit is None and isinstance(name, _decoratable):
+            # Used as a decorator without arguments.
+            return cls()(name)
+        self = object.__new__(cls)
         if limit is None and isinstance(name, Number):
             name, limit = None, name
         self._default_name = not name
         self.name = name or _generate_default_name()
-        self.limit = limit or 0
+        if isinstance(limit, AdaptiveLimit):
+            self.adaptive, self.limit = limit, None
+        else:
+            self.limit = limit or 0
         self.callback = callback
-        self.start = None
-        self.end = None
-        self.delta = None
+        self.sampler = sampler
+        self.measure = measure_flags(cpu, gc, memory) if cpu or gc or memory else 0
 
-        # This is going to get shallow copied, so we shouldn't use [].
-        self.blocks = None
+        # None means the sampling decision has not been made yet.
+        self._sampled = None
+        return self
+
+    def __copy__(self):
+        # copy() would otherwise call __new__ without arguments.
+        instance = object.__new__(type(self))
+        instance.__dict__.update(self.__dict__)
+        return instance
 
     def block(self, name=None):
+        if self._sampled is False:
+            return _null_block
         assert self.start is not None, 'Blocks are meant to be used inside with.'
         if self.blocks is None:
             self.blocks = []
-        block = OptimizeBlock(name or _generate_default_name())
+        block = OptimizeBlock(name or _generate_default_name(), self.measure)
         self.blocks.append(block)
         return block
 
+    def _get_sampler(self):
+        if self._rule is not None and self._rule.sampler is not None:
+            return self._rule.sampler
+        return self.sampler or get_sampler()
+
+    def _apply_rule(self):
+        # Returns whether the block should be timed at all.
+        if not config._enabled:
+            return False
+        if config._overrides is None:
+            return True
+        rule = self._rule = config._overrides.get(self.name)
+        if rule is None:
+            return True
+        if rule.limit is not None:
+            self.adaptive, self.limit = None, rule.limit
+        return rule.enabled
+
+    def rename(self, name, limit=None):
+        """Rename this optimize_later, possibly while running, e.g. once a request is routed to a view.
+
+        limit replaces the limit if given, and the rule from config.set_overrides() for the new name applies
+        as if it had been entered with it: its limit wins, and if it disables the name, nothing is reported.
+        The watchdog and profiler deadlines are rescheduled from the new limit. An entry sampled under the old
+        name is sampled again with the sampler of the new rule, if it has one, so that its sample rate applies
+        to entries timed under the old name's sampler.
+        """
+        self.name = name
+        if isinstance(limit, AdaptiveLimit):
+            self.adaptive, self.limit = limit, None
+        elif limit is not None:
+            self.adaptive, self.limit = None, limit
+        if self._nested is not None:
+            self._nested.name = name
+        if not self._sampled:
+            # Not entered yet, so the rule is resolved on entry, or not timed at all.
+            return
+        self._rule = None
+        self._discarded = not self._apply_rule() or self._rule is not None and self._rule.sampler is not None \
+            and not self._rule.sampler()
+        if self.start is None or self._nested is not None:
+            return
+        if self._watchdog_timer is not None:
+            self._watchdog.cancel(self._watchdog_timer)
+            self._watchdog_timer = None
+        if self._profile is not None and self._profile.stacks is None:
+            # Not sampling yet, so start sampling from the new limit instead.
+            self._profiler.stop(self._profile)
+            self._profile = None
+        if not self._discarded:
+            self._watch()
+
     def __enter__(self):
-        assert self.start is None, 'Do not reuse optimize_later objects.'
+        assert self.start is None and self._sampled is not False, 'Do not reuse optimize_later objects.'
+        if self._sampled is None:
+            if config._enabled and config._overrides is None:
+                # The common case, decided without resolving a rule.
+                sampler = self.sampler or config._sampler
+            elif self._apply_rule():
+                sampler = self._get_sampler()
+            else:
+                self._sampled = False
+                return self
+            self._sampled = sampler is None or sampler()
+            if not self._sampled:
+                return self
+        if get_nesting():
+            self._previous_active = parent = get_active()
+            set_active(self)
+            if parent is not None:
+                self._nested = parent.block(self.name)
+
+        if self.measure:
+            self._measurements = Measurements(self.measure)
+            self._measurements.start()
         self.start = perf_counter()
+        if self._nested is None:
+            self._watch()
         return self
 
+    def _watch(self):
+        # Schedules the in-progress report and stack sampling from the current limit.
+        watchdog = get_watchdog()
+        profiler = get_profiler() if self._profile is None else None
+        if watchdog is not None or profiler is not None:
+            limit = self.limit if self.adaptive is None else self.adaptive.get_limit(self.name)
+            if limit and watchdog is not None:
+                self._watchdog = watchdog
+                self._watchdog_timer = watchdog.schedule(self.start + limit, self._report_in_progress,
+                                                         get_ident(), limit, get_callbacks())
+            if limit and profiler is not None:
+                self._profiler = profiler
+                self._profile = profiler.schedule(self.start + limit * profiler.threshold, get_ident())
+
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if not self._sampled:
+            return
         self.end = perf_counter()
         self.delta = self.end - self.start
+        if self._measurements is not None:
+            self._measurements.stop()
+        if self._previous_active is not _not_active:
+            set_active(self._previous_active)
+            self._previous_active = _not_active
+        if self._nested is not None:
+            self._exit_nested()
+            return
+        if self._watchdog_timer is not None:
+            self._watchdog.cancel(self._watchdog_timer)
+        stacks = None
+        if self._profile is not None:
+            stacks = self._profiler.stop(self._profile)
+        if self._discarded:
+            # Disabled or sampled out by rename().
+            return
+        if _recorders:
+            record(self.name, self.delta)
+        if self.adaptive is not None:
+            self.limit = self.adaptive.observe(self.name, self.delta)
+            if self.limit is None:
+                return
         if self.delta >= self.limit:
-            self._report()
+            self._report(stacks)
 
-    def _report(self):
-        report = OptimizeReport(self.name, self.limit, self.start, self.end, self.delta, self.blocks or [])
-        if self.callback:
+    def _exit_nested(self):
+        # Only the outermost optimize_later is evaluated against its limit; this one becomes its child block.
+        block = self._nested
+        block.start, block.end = self.start, self.end
+        block._blocks = self.blocks
+        block._measurements = self._measurements
+        if _recorders:
+            record(self.name, self.delta)
+
+    def _report(self, stacks=None):
+        throttle = get_throttle()
+        if throttle is None:
+            suppressed = 0
+        else:
+            suppressed = throttle.acquire(self.name)
+            if suppressed is None:
+                return
+
+        sampler = self._get_sampler()
+        report = OptimizeReport(self.name, self.limit, self.start, self.end, self.delta, self.blocks or [], suppressed,
+                                sampler.rate if sampler is not None else 1.0,
+                                in_progress_report=self.in_progress_report, stacks=stacks,
+                                measurements=self._measurements, generator=self.generator, thread=get_ident())
+        self._dispatch(report)
+
+    def _report_in_progress(self, thread, limit, callbacks):
+        # Runs on the watchdog thread, so the callbacks of the timed thread are passed in.
+        frame = sys._current_frames().get(thread)
+        stack = traceback.format_stack(frame) if frame is not None else []
+        del frame
+
+        sampler = self._get_sampler()
+        report = OptimizeReport(self.name, limit, self.start, None, perf_counter() - self.start,
+                                [block.snapshot() for block in self.blocks or []], 0,
+                                sampler.rate if sampler is not None else 1.0, stack, thread=thread)
+        self.in_progress_report = report
+        self._dispatch(report, callbacks)
+
+    def _dispatch(self, report, callbacks=None):
+        if self._rule is not None and self._rule.callbacks is not None:
+            global_callback(report, self._rule.callbacks)
+        elif self.callback is not None:
             try:
                 self.callback(report)
             except Exception:
                 log.exception('Failed to invoke user-specified callback: %r', self.callback)
         else:
-            global_callback(report)
+            global_callback(report, callbacks)
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.__exit__(exc_type, exc_val, exc_tb)
+
+    def iterate(self, iterable):
+        """Time the lifetime of a generator or iterator, synchronous or asynchronous, as it is consumed.
+
+        Only time spent producing items counts towards the limit, not time suspended at yield. The report is
+        made when the iterator is exhausted, raises, or is closed, and has the number of items, time to the first
+        item and the slowest item as report.generator.
+        """
+        assert self.start is None and self._sampled is None, 'Do not reuse optimize_later objects.'
+        instance = self._copy()
+        if not instance._apply_rule():
+            return iterable
+        sampler = instance._get_sampler()
+        if sampler is not None and not sampler():
+            return iterable
+        if hasattr(iterable, '__aiter__'):
+            return TimedAsyncGenerator(instance, iterable.__aiter__())
+        return TimedGenerator(instance, iter(iterable))
+
+    def _finish_generator(self, start, end, active, stats):
+        self.start, self.end, self.delta = start, end, active
+        self.generator = stats
+        if _recorders:
+            record(self.name, active)
+        if self.adaptive is not None:
+            self.limit = self.adaptive.observe(self.name, active)
+            if self.limit is None:
+                return
+        if active >= self.limit:
+            self._report()
+
+    def _copy(self):
+        instance = copy(self)
+        instance._sampled = True
+        return instance
+
+    def _entry(self):
+        # For decorated calls on the full path: the copy to time the call with, or None if it is sampled out.
+        # Without overrides, which can change the sampler by name, the sampler is asked before copying.
+        if config._overrides is not None:
+            return copy(self)
+        sampler = self.sampler or config._sampler
+        if sampler is not None and not sampler():
+            return None
+        return self._copy()
+
+    def _report_call(self, start, end):
+        instance = self._copy()
+        instance.start, instance.end, instance.delta = start, end, end - start
+        instance._report()
 
     def __call__(self, function):
+        if isinstance(function, (staticmethod, classmethod)):
+            return type(function)(self(function.__func__))
+
         if self._default_name:
             self.name = '%s:%s' % (function.__module__, function.__name__)
 
-        @wraps(function)
-        def wrapped(*args, **kwargs):
-            with copy(self):
-                return function(*args, **kwargs)
+        # Without features needing the full context manager, calls are timed directly, and objects are only
+        # created for calls exceeding the limit. Features enabled later are checked for on every call.
+        fast = self.adaptive is None and not self.measure
+
+        if isgeneratorfunction(function) or isasyncgenfunction is not None and isasyncgenfunction(function):
+            # Timed while producing items, from the first next() until the generator finishes or is closed.
+            @wraps(function)
+            def wrapped(*args, **kwargs):
+                return self.iterate(function(*args, **kwargs))
+        elif iscoroutinefunction(function):
+            @wraps(function)
+            async def wrapped(*args, **kwargs):
+                if not config._enabled:
+                    return await function(*args, **kwargs)
+                if not fast or config._full_path:
+                    instance = self._entry()
+                    if instance is None:
+                        return await function(*args, **kwargs)
+                    with instance:
+                        return await function(*args, **kwargs)
+                sampler = self.sampler or config._sampler
+                if sampler is not None and not sampler():
+                    return await function(*args, **kwargs)
+
+                start = perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    end = perf_counter()
+                    if _recorders:
+                        record(self.name, end - start)
+                    if end - start >= self.limit:
+                        self._report_call(start, end)
+        else:
+            @wraps(function)
+            def wrapped(*args, **kwargs):
+                if not config._enabled:
+                    return function(*args, **kwargs)
+                if not fast or config._full_path:
+                    instance = self._entry()
+                    if instance is None:
+                        return function(*args, **kwargs)
+                    with instance:
+                        return function(*args, **kwargs)
+                sampler = self.sampler or config._sampler
+                if sampler is not None and not sampler():
+                    return function(*args, **kwargs)
+
+                start = perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    end = perf_counter()
+                    if _recorders:
+                        record(self.name, end - start)
+                    if end - start >= self.limit:
+                        self._report_call(start, end)
         return wrapped
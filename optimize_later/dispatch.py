@@ -0,0 +1,121 @@
+import atexit
+import logging
+import os
+import weakref
+from collections import deque
+
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
+log = logging.getLogger(__name__.rpartition('.')[0] or __name__)
+
+DROP_OLDEST = 'drop-oldest'
+DROP_NEWEST = 'drop-newest'
+BLOCK = 'block'
+
+_dispatchers = weakref.WeakSet()
+
+
+class AsyncDispatcher(object):
+    """Invokes a callback on a background thread, fed by a bounded queue.
+
+    Use an instance as a callback, e.g. register_callback(AsyncDispatcher(report_to_sentry)),
+    and reports will be handed off instead of being processed inside __exit__.
+    """
+
+    def __init__(self, callback, maxsize=1024, overflow=DROP_OLDEST, flush_timeout=5):
+        if overflow not in (DROP_OLDEST, DROP_NEWEST, BLOCK):
+            raise ValueError('Unknown overflow policy: %r' % (overflow,))
+        self.callback = callback
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.flush_timeout = flush_timeout
+        self.dispatched = 0
+        self.dropped = 0
+
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._busy = False
+        self._closed = False
+        self._thread = None
+        self._pid = None
+        _dispatchers.add(self)
+
+    def __call__(self, report):
+        with self._lock:
+            if self._closed:
+                self.dropped += 1
+                return
+            if len(self._queue) >= self.maxsize:
+                if self.overflow == DROP_NEWEST:
+                    self.dropped += 1
+                    return
+                elif self.overflow == DROP_OLDEST:
+                    self._queue.popleft()
+                    self.dropped += 1
+                else:
+                    self._ensure_worker()
+                    while len(self._queue) >= self.maxsize:
+                        self._not_full.wait()
+            self._queue.append(report)
+            self._ensure_worker()
+            self._not_empty.notify()
+
+    @property
+    def pending(self):
+        return len(self._queue)
+
+    def _ensure_worker(self):
+        # Threads do not survive fork(), so pre-fork servers need a new worker in each child.
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._busy = False
+            self._thread = threading.Thread(target=self._worker, name='optimize-later-dispatch')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                while not self._queue:
+                    self._busy = False
+                    self._idle.notify_all()
+                    if self._closed:
+                        return
+                    self._not_empty.wait()
+                report = self._queue.popleft()
+                self._busy = True
+                self._not_full.notify()
+
+            try:
+                self.callback(report)
+            except Exception:
+                log.exception('Failed to invoke asynchronous callback: %r', self.callback)
+            self.dispatched += 1
+
+    def flush(self, timeout=None):
+        """Wait until every queued report has been dispatched. Returns False on timeout."""
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                return not self._queue
+            return self._idle.wait_for(lambda: not self._queue and not self._busy, timeout)
+
+    def close(self, timeout=None):
+        """Flush and stop the worker thread. Reports submitted afterwards are dropped."""
+        flushed = self.flush(self.flush_timeout if timeout is None else timeout)
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+        return flushed
+
+
+@atexit.register
+def flush_dispatchers():
+    for dispatcher in list(_dispatchers):
+        if not dispatcher._closed and not dispatcher.flush(dispatcher.flush_timeout):
+            log.warning('Timed out flushing %d reports from %r', dispatcher.pending, dispatcher)
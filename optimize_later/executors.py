@@ -0,0 +1,184 @@
+"""Carry optimize_later state into concurrent.futures executors.
+
+Work submitted to an executor runs outside the submitter's callback context and active block. Wrapping the
+executor in ContextExecutor, or a function in propagate(), runs the work with the submitter's optimize_context
+callbacks, and times it as a child block of the submitting optimize_later or block.
+"""
+import logging
+import pickle
+import traceback
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+
+from optimize_later.config import get_active, optimize_context, _get_context
+from optimize_later.core import OptimizeBlock
+
+log = logging.getLogger(__name__.rpartition('.')[0] or __name__)
+
+
+def _task_name(function):
+    return '%s:%s' % (getattr(function, '__module__', None), getattr(function, '__name__', None) or repr(function))
+
+
+def _child_block(parent, name):
+    if parent is None:
+        parent = get_active()
+    if parent is None:
+        return None
+    return parent.block(name)
+
+
+class _ThreadTask(object):
+    __slots__ = ('function', 'callbacks', 'block')
+
+    def __init__(self, function, callbacks, block):
+        self.function = function
+        self.callbacks = callbacks
+        self.block = block
+
+    def __call__(self, *args, **kwargs):
+        if self.callbacks is None:
+            return self._run(args, kwargs)
+        with optimize_context(self.callbacks, reset=True):
+            return self._run(args, kwargs)
+
+    def _run(self, args, kwargs):
+        if self.block is None:
+            return self.function(*args, **kwargs)
+        with self.block:
+            return self.function(*args, **kwargs)
+
+
+def propagate(function, parent=None):
+    """Wrap function to run in another thread with the current callbacks, timed as a child block of parent.
+
+    parent defaults to the active block, which requires nesting to be enabled. Each wrapper is meant to be
+    called once, as its block is created when wrapping, so that blocks stay in submission order.
+    """
+    return _ThreadTask(function, _get_context(), _child_block(parent, _task_name(function)))
+
+
+def _picklable_callbacks(callbacks):
+    result = []
+    for callback in callbacks:
+        try:
+            pickle.dumps(callback)
+        except Exception:
+            log.debug('Not propagating unpicklable callback to worker process: %r', callback)
+        else:
+            result.append(callback)
+    return result
+
+
+class _RemoteTraceback(Exception):
+    # Shown as the cause of exceptions from worker processes, as ProcessPoolExecutor does.
+    def __init__(self, tb):
+        self.tb = tb
+
+    def __str__(self):
+        return self.tb
+
+
+class _TaskError(object):
+    """Returned by a process task in place of the result when the function raised error."""
+
+    def __init__(self, error, tb):
+        self.error = error
+        self.tb = tb
+
+
+class _ProcessTask(object):
+    """Runs in the worker process, returning the result, or a _TaskError, along with the block as a dictionary."""
+
+    def __init__(self, function, callbacks, name, measure):
+        self.function = function
+        self.callbacks = callbacks
+        self.name = name
+        self.measure = measure
+
+    def __call__(self, *args, **kwargs):
+        block = OptimizeBlock(self.name, self.measure)
+        try:
+            if self.callbacks is None:
+                with block:
+                    result = self.function(*args, **kwargs)
+            else:
+                with optimize_context(self.callbacks, reset=True), block:
+                    result = self.function(*args, **kwargs)
+        except Exception as e:
+            # Returned rather than raised, so that the timing comes back without touching the exception.
+            return _TaskError(e, traceback.format_exc()), block.to_dict()
+        return result, block.to_dict()
+
+
+class _ProcessFuture(Future):
+    """The future of a process task, which fills in the child block when the worker returns its timing."""
+
+    def __init__(self, future, block):
+        super(_ProcessFuture, self).__init__()
+        self._future = future
+        self._block = block
+        future.add_done_callback(self._done)
+
+    def cancel(self):
+        return self._future.cancel()
+
+    def running(self):
+        return self._future.running()
+
+    def _done(self, future):
+        if future.cancelled():
+            super(_ProcessFuture, self).cancel()
+            return
+        error = future.exception()
+        if error is not None:
+            # The task itself failed, e.g. as the worker died or its arguments could not be pickled.
+            self.set_exception(error)
+            return
+        result, data = future.result()
+        self._fill(data)
+        if isinstance(result, _TaskError):
+            result.error.__cause__ = _RemoteTraceback('\n"""\n%s"""' % (result.tb,))
+            self.set_exception(result.error)
+        else:
+            self.set_result(result)
+
+    def _fill(self, data):
+        if data is None or not isinstance(self._block, OptimizeBlock):
+            return
+        timed = OptimizeBlock.from_dict(data)
+        block = self._block
+        block.start, block.end = timed.start, timed.end
+        block._blocks, block._measurements = timed._blocks, timed._measurements
+
+
+class ContextExecutor(Executor):
+    """Wraps a thread or process pool executor, propagating the submitter's callbacks and active block.
+
+    Each submitted call becomes a child block of parent, or of the block active at submission if nesting is
+    enabled. Wait for the futures before the parent finishes, or the children show as still running.
+
+    With a ProcessPoolExecutor, only callbacks that can be pickled are propagated, and the worker's timing is
+    sent back as a dictionary. Block times there come from the worker's perf_counter, which is system-wide on
+    common platforms.
+    """
+
+    def __init__(self, executor, parent=None):
+        self.executor = executor
+        self.parent = parent
+        self.processes = isinstance(executor, ProcessPoolExecutor)
+
+    def submit(self, fn, *args, **kwargs):
+        if not self.processes:
+            return self.executor.submit(propagate(fn, self.parent), *args, **kwargs)
+
+        name = _task_name(fn)
+        block = _child_block(self.parent, name)
+        callbacks = _get_context()
+        if callbacks is not None:
+            callbacks = _picklable_callbacks(callbacks)
+        measure = block._measurements.flags if isinstance(block, OptimizeBlock) and block._measurements else 0
+        future = self.executor.submit(_ProcessTask(fn, callbacks, name, measure), *args, **kwargs)
+        return _ProcessFuture(future, block)
+
+    def shutdown(self, wait=True, **kwargs):
+        self.executor.shutdown(wait, **kwargs)
@@ -0,0 +1,199 @@
+import logging
+import os
+import re
+import socket
+from collections import deque
+from itertools import accumulate
+
+from optimize_later.stats import bucket_bounds
+from optimize_later.utils import register_after_fork
+
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
+log = logging.getLogger(__name__.rpartition('.')[0] or __name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape_label(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def render_prometheus(source, metric='optimize_later_duration_seconds', buckets=DEFAULT_BUCKETS):
+    """Render the histograms of source, e.g. a StatsAggregator or SharedStats, in Prometheus text format.
+
+    Each fine-grained histogram bucket is counted under the first `le` bound at or above its upper bound.
+    """
+    lines = [
+        '# HELP %s Time spent in optimize_later blocks.' % (metric,),
+        '# TYPE %s histogram' % (metric,),
+    ]
+    for name, histogram in sorted(source.snapshot().items()):
+        label = 'name="%s"' % (_escape_label(name),)
+        counts = [0] * len(buckets)
+        bound = 0
+        for index, count in enumerate(histogram.buckets):
+            if not count:
+                continue
+            upper = bucket_bounds(index)[1]
+            while bound < len(buckets) and buckets[bound] < upper:
+                bound += 1
+            if bound < len(buckets):
+                counts[bound] += count
+
+        for le, count in zip(buckets, accumulate(counts)):
+            lines.append('%s_bucket{%s,le="%s"} %d' % (metric, label, le, count))
+        lines.append('%s_bucket{%s,le="+Inf"} %d' % (metric, label, histogram.count))
+        lines.append('%s_sum{%s} %r' % (metric, label, histogram.total))
+        lines.append('%s_count{%s} %d' % (metric, label, histogram.count))
+    return '\n'.join(lines) + '\n'
+
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class PrometheusApp(object):
+    """A WSGI application serving render_prometheus(source)."""
+
+    def __init__(self, source, **kwargs):
+        self.source = source
+        self.kwargs = kwargs
+
+    def __call__(self, environ, start_response):
+        body = render_prometheus(self.source, **self.kwargs).encode('utf-8')
+        start_response('200 OK', [('Content-Type', PROMETHEUS_CONTENT_TYPE), ('Content-Length', str(len(body)))])
+        return [body]
+
+
+def prometheus_view(source, **kwargs):
+    """Return a Django view serving render_prometheus(source)."""
+    from django.http import HttpResponse
+
+    def view(request):
+        return HttpResponse(render_prometheus(source, **kwargs), content_type=PROMETHEUS_CONTENT_TYPE)
+    return view
+
+
+_invalid_statsd = re.compile(r'[^A-Za-z0-9_.\-]')
+
+
+class StatsdClient(object):
+    """Sends timings to StatsD or DogStatsD over UDP, coalesced into packets of up to max_packet bytes.
+
+    Use as a recorder, register_recorder(client.record), to send every timing, or as a callback,
+    register_callback(client), to send only slow reports. Packets are sent from a background thread
+    every flush_interval seconds; up to max_buffer timings are buffered, further ones are dropped.
+    With dogstatsd=True, block names are sent as a tag instead of being part of the metric name.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='optimize_later', dogstatsd=False, max_packet=1432,
+                 flush_interval=1, max_buffer=100000):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.dogstatsd = dogstatsd
+        self.max_packet = max_packet
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.dropped = 0
+        self.packets = 0
+
+        self._buffer = deque()
+        self._names = {}
+        self._socket = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        self._check_pid = not register_after_fork(self, StatsdClient._forget_thread)
+
+    def _forget_thread(self):
+        # The parent's thread does not exist in the child, and its lock may have been held while forking.
+        self._thread = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._buffer.clear()
+
+    def _metric(self, name):
+        try:
+            return self._names[name]
+        except KeyError:
+            if self.dogstatsd:
+                metric = '%s.duration:%%.3f|ms|#name:%s' % (self.prefix, name.replace(',', '_').replace('|', '_'))
+            else:
+                metric = '%s.%s:%%.3f|ms' % (self.prefix, _invalid_statsd.sub('_', name))
+            self._names[name] = metric
+            return metric
+
+    def record(self, name, delta):
+        if len(self._buffer) >= self.max_buffer:
+            self.dropped += 1
+            return
+        self._buffer.append((name, delta))
+        if self._thread is None or self._check_pid and self._pid != os.getpid():
+            self._start()
+
+    def __call__(self, report):
+        self.record(report.name, report.delta)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None and (not self._check_pid or self._pid == os.getpid()):
+                return
+            self._pid = os.getpid()
+            self._socket = socket.socket(socket.AF_INET6 if ':' in self.address[0] else socket.AF_INET,
+                                         socket.SOCK_DGRAM)
+            self._thread = threading.Thread(target=self._run, name='optimize-later-statsd')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._closed:
+                    self._wakeup.wait(self.flush_interval)
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
+
+    def _packets(self):
+        buffer = self._buffer
+        packet = []
+        size = 0
+        while buffer:
+            try:
+                name, delta = buffer.popleft()
+            except IndexError:
+                break
+            line = (self._metric(name) % (delta * 1000)).encode('utf-8')
+            if packet and size + len(line) + 1 > self.max_packet:
+                yield b'\n'.join(packet)
+                packet = []
+                size = 0
+            packet.append(line)
+            size += len(line) + 1
+        if packet:
+            yield b'\n'.join(packet)
+
+    def flush(self):
+        """Send every buffered timing now."""
+        if self._socket is None:
+            return
+        for packet in self._packets():
+            try:
+                self._socket.sendto(packet, self.address)
+                self.packets += 1
+            except (OSError, socket.error):
+                log.exception('Failed to send StatsD packet to %s:%d', *self.address)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._socket.close()
@@ -0,0 +1,167 @@
+from time import perf_counter
+
+
+class GeneratorStats(object):
+    """Statistics of a timed generator, available on its report as report.generator."""
+
+    __slots__ = ('items', 'first_item', 'slowest_item', 'wall')
+
+    def __init__(self):
+        self.items = 0
+        self.first_item = None
+        self.slowest_item = 0.0
+        self.wall = 0.0
+
+    def format(self, precision=3):
+        return '%d item%s, first after %s, slowest %.*fs, %.*fs wall' % (
+            self.items, '' if self.items == 1 else 's',
+            '-' if self.first_item is None else '%.*fs' % (precision, self.first_item),
+            precision, self.slowest_item, precision, self.wall,
+        )
+
+    def to_dict(self):
+        return {'items': self.items, 'first_item': self.first_item, 'slowest_item': self.slowest_item,
+                'wall': self.wall}
+
+
+class _TimedIteratorBase(object):
+    __slots__ = ('_timer', '_iterator', '_stats', '_active', '_start', '_done')
+
+    def __init__(self, timer, iterator):
+        self._timer = timer
+        self._iterator = iterator
+        self._stats = GeneratorStats()
+        self._active = 0.0
+        self._start = None
+        self._done = False
+
+    def _resumed(self, start, end, item):
+        delta = end - start
+        self._active += delta
+        stats = self._stats
+        if item:
+            stats.items += 1
+            if stats.first_item is None:
+                stats.first_item = end - self._start
+            if delta > stats.slowest_item:
+                stats.slowest_item = delta
+
+    def _finish(self, end):
+        if self._done:
+            return
+        self._done = True
+        if self._start is None:
+            return
+        self._stats.wall = end - self._start
+        self._timer._finish_generator(self._start, end, self._active, self._stats)
+
+
+class TimedGenerator(_TimedIteratorBase):
+    """Wraps a generator or iterator, counting only the time spent producing items.
+
+    The report is made when the iterator is exhausted, raises, or is closed, and its delta is the active
+    time, excluding time suspended at yield.
+    """
+
+    __slots__ = ()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self._resume(None, None)
+
+    def send(self, value):
+        return self._resume(value, None)
+
+    def throw(self, *exc_info):
+        return self._resume(None, exc_info)
+
+    def _resume(self, value, exc_info):
+        start = perf_counter()
+        if self._start is None:
+            self._start = start
+        try:
+            if exc_info is not None:
+                item = self._iterator.throw(*exc_info)
+            elif value is None:
+                item = next(self._iterator)
+            else:
+                item = self._iterator.send(value)
+        except BaseException:
+            end = perf_counter()
+            self._resumed(start, end, False)
+            self._finish(end)
+            raise
+        self._resumed(start, perf_counter(), True)
+        return item
+
+    def close(self):
+        if self._done:
+            return
+        start = perf_counter()
+        try:
+            close = getattr(self._iterator, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            end = perf_counter()
+            if self._start is not None:
+                self._resumed(start, end, False)
+            self._finish(end)
+
+    def __del__(self):
+        # Like generators, report when garbage collected without being exhausted.
+        if not self._done and self._start is not None:
+            self.close()
+
+
+class TimedAsyncGenerator(_TimedIteratorBase):
+    """Like TimedGenerator, for asynchronous generators and iterators."""
+
+    __slots__ = ()
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        return self._resume(None, None)
+
+    def asend(self, value):
+        return self._resume(value, None)
+
+    def athrow(self, *exc_info):
+        return self._resume(None, exc_info)
+
+    async def _resume(self, value, exc_info):
+        start = perf_counter()
+        if self._start is None:
+            self._start = start
+        try:
+            if exc_info is not None:
+                item = await self._iterator.athrow(*exc_info)
+            elif value is None:
+                item = await self._iterator.__anext__()
+            else:
+                item = await self._iterator.asend(value)
+        except BaseException:
+            end = perf_counter()
+            self._resumed(start, end, False)
+            self._finish(end)
+            raise
+        self._resumed(start, perf_counter(), True)
+        return item
+
+    async def aclose(self):
+        if self._done:
+            return
+        start = perf_counter()
+        try:
+            aclose = getattr(self._iterator, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+        finally:
+            end = perf_counter()
+            if self._start is not None:
+                self._resumed(start, end, False)
+            self._finish(end)
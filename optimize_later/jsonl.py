@@ -0,0 +1,178 @@
+import atexit
+import gzip
+import json
+import logging
+import os
+import shutil
+import weakref
+from time import monotonic, time
+
+from optimize_later.utils import register_after_fork
+
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
+log = logging.getLogger(__name__.rpartition('.')[0] or __name__)
+
+_sinks = weakref.WeakSet()
+
+
+def open_reports(path, skipped=None):
+    """Iterate over the reports, as dictionaries, in a JSON lines file, which may be gzipped.
+
+    Malformed lines, such as the last line of a worker killed while writing, are skipped, and their line
+    numbers appended to skipped if given.
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                report = json.loads(line)
+            except ValueError:
+                report = None
+            if isinstance(report, dict):
+                yield report
+            elif skipped is not None:
+                skipped.append(number)
+
+
+class JSONLinesSink(object):
+    """A callback writing each report and its block tree as one line of JSON.
+
+    Writes go through a buffer of buffer_size bytes, flushed at least every flush_interval seconds, by a
+    timer thread if no other report comes, and at exit.
+    The file is rotated when it reaches max_bytes or is older than max_age seconds, keeping up to
+    `backups` old files as path.1, path.2, ..., which are gzipped if compress is true. Compression runs on
+    a background thread, so the report that triggers a rotation does not wait for it.
+    """
+
+    def __init__(self, path, max_bytes=None, max_age=None, backups=5, compress=False, buffer_size=65536,
+                 flush_interval=1):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backups = backups
+        self.compress = compress
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._opened = None
+        self._flushed = None
+        self._timer = None
+        self._compressor = None
+        self._encoder = json.JSONEncoder(separators=(',', ':'), default=repr)
+        _sinks.add(self)
+        register_after_fork(self, JSONLinesSink._forget_timer)
+
+    def __call__(self, report):
+        data = report.to_dict()
+        data['time'] = time()
+        line = (self._encoder.encode(data) + '\n').encode('utf-8')
+
+        with self._lock:
+            if self._file is None:
+                self._open()
+            elif self._should_rotate(len(line)):
+                self._rotate()
+            self._file.write(line)
+            self._size += len(line)
+
+            now = monotonic()
+            if now - self._flushed >= self.flush_interval:
+                self._file.flush()
+                self._flushed = now
+            elif self._timer is None:
+                self._timer = threading.Timer(self.flush_interval - (now - self._flushed), self._flush_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_timer(self):
+        with self._lock:
+            self._timer = None
+            if self._file is not None:
+                self._file.flush()
+                self._flushed = monotonic()
+
+    def _forget_timer(self):
+        # The timer thread does not survive fork.
+        self._timer = None
+
+    def _open(self):
+        self._file = open(self.path, 'ab', buffering=self.buffer_size)
+        self._size = self._file.tell()
+        self._opened = self._flushed = monotonic()
+
+    def _should_rotate(self, size):
+        if self._size == 0:
+            # Rotating an empty file would only make empty backups, e.g. for lines larger than max_bytes.
+            return False
+        if self.max_bytes is not None and self._size + size > self.max_bytes:
+            return True
+        return self.max_age is not None and monotonic() - self._opened >= self.max_age
+
+    def _backup_name(self, index):
+        return '%s.%d%s' % (self.path, index, '.gz' if self.compress else '')
+
+    def _rotate(self):
+        self._file.close()
+        if self._compressor is not None:
+            # Only when rotating faster than compressing: wait, so that backups keep their order.
+            self._compressor.join()
+            self._compressor = None
+        if self.backups > 0:
+            for index in range(self.backups - 1, 0, -1):
+                if os.path.exists(self._backup_name(index)):
+                    os.replace(self._backup_name(index), self._backup_name(index + 1))
+            if self.compress:
+                source = '%s.1' % (self.path,)
+                os.replace(self.path, source)
+                self._compressor = threading.Thread(target=self._compress, args=(source, self._backup_name(1)),
+                                                    name='optimize-later-compress')
+                self._compressor.start()
+            else:
+                os.replace(self.path, self._backup_name(1))
+        else:
+            os.unlink(self.path)
+        self._open()
+
+    @staticmethod
+    def _compress(source, target):
+        try:
+            with open(source, 'rb') as f, gzip.open(target + '.tmp', 'wb') as compressed:
+                shutil.copyfileobj(f, compressed)
+            os.replace(target + '.tmp', target)
+            os.unlink(source)
+        except Exception:
+            log.exception('Failed to compress %s', source)
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                self._flushed = monotonic()
+
+    def close(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            compressor, self._compressor = self._compressor, None
+        if compressor is not None:
+            compressor.join()
+
+
+@atexit.register
+def flush_sinks():
+    for sink in list(_sinks):
+        sink.flush()
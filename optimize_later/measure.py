@@ -0,0 +1,143 @@
+import gc
+import threading
+import time
+import tracemalloc
+from threading import get_ident
+from time import perf_counter
+
+CPU = 1
+GC = 2
+MEMORY = 4
+
+# Per-thread CPU time where available, otherwise process-wide.
+_cpu_time = getattr(time, 'thread_time', time.process_time)
+
+_gc_totals = {}
+_gc_starts = {}
+
+# GC callbacks and tracemalloc slow down the whole process, so they are only active while blocks measuring
+# them are running. These count those blocks.
+_lock = threading.Lock()
+_gc_users = 0
+_memory_users = 0
+_memory_started = False
+
+
+def _gc_callback(phase, info):
+    # Collections run on the thread that triggered them, so time is attributed to that thread.
+    ident = get_ident()
+    if phase == 'start':
+        _gc_starts[ident] = perf_counter()
+    else:
+        start = _gc_starts.pop(ident, None)
+        if start is not None:
+            _gc_totals[ident] = _gc_totals.get(ident, 0.0) + perf_counter() - start
+
+
+def _acquire(flags):
+    global _gc_users, _memory_users, _memory_started
+    with _lock:
+        if flags & GC:
+            _gc_users += 1
+            if _gc_users == 1:
+                gc.callbacks.append(_gc_callback)
+        if flags & MEMORY:
+            _memory_users += 1
+            if _memory_users == 1 and not tracemalloc.is_tracing():
+                # Tracing started elsewhere is left running.
+                tracemalloc.start()
+                _memory_started = True
+
+
+def _release(flags):
+    global _gc_users, _memory_users, _memory_started
+    with _lock:
+        if flags & GC:
+            _gc_users -= 1
+            if not _gc_users:
+                gc.callbacks.remove(_gc_callback)
+                _gc_starts.clear()
+        if flags & MEMORY:
+            _memory_users -= 1
+            if not _memory_users and _memory_started:
+                tracemalloc.stop()
+                _memory_started = False
+
+
+def gc_time():
+    """Total time the current thread has spent in garbage collection while GC timing was active."""
+    return _gc_totals.get(get_ident(), 0.0)
+
+
+def measure_flags(cpu=False, gc=False, memory=False):
+    return (CPU if cpu else 0) | (GC if gc else 0) | (MEMORY if memory else 0)
+
+
+class Measurements(object):
+    """Opt-in measurements beyond wall-clock time: thread CPU time, GC time, and net traced allocations.
+
+    Memory is measured with tracemalloc, which is process-wide, so allocations by other threads are
+    included. Both tracemalloc and the GC callback slow down the whole process, so they are only active while
+    at least one block measuring them is running: tracemalloc is started by the first such block and stopped
+    after the last, unless it was already tracing.
+    """
+
+    __slots__ = ('flags', 'cpu', 'gc', 'memory')
+
+    def __init__(self, flags):
+        self.flags = flags
+        self.cpu = None
+        self.gc = None
+        self.memory = None
+
+    def start(self):
+        flags = self.flags
+        if flags & (GC | MEMORY):
+            _acquire(flags)
+        if flags & MEMORY:
+            self.memory = tracemalloc.get_traced_memory()[0]
+        if flags & GC:
+            self.gc = gc_time()
+        if flags & CPU:
+            self.cpu = _cpu_time()
+
+    def stop(self):
+        flags = self.flags
+        if flags & CPU:
+            self.cpu = _cpu_time() - self.cpu
+        if flags & GC:
+            self.gc = gc_time() - self.gc
+        if flags & MEMORY:
+            self.memory = tracemalloc.get_traced_memory()[0] - self.memory
+        if flags & (GC | MEMORY):
+            _release(flags)
+
+    def format(self, precision=3):
+        parts = []
+        if self.flags & CPU:
+            parts.append('cpu %.*fs' % (precision, self.cpu))
+        if self.flags & GC:
+            parts.append('gc %.*fs' % (precision, self.gc))
+        if self.flags & MEMORY:
+            parts.append('%+d bytes' % (self.memory,))
+        return ', '.join(parts)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild finished measurements from the keys added by to_dict(), without starting any tracing."""
+        measurements = cls.__new__(cls)
+        measurements.flags = measure_flags('cpu_time' in data, 'gc_time' in data, 'memory' in data)
+        measurements.cpu = data.get('cpu_time')
+        measurements.gc = data.get('gc_time')
+        measurements.memory = data.get('memory')
+        return measurements
+
+    def to_dict(self):
+        result = {}
+        if self.flags & CPU:
+            result['cpu_time'] = self.cpu
+        if self.flags & GC:
+            result['gc_time'] = self.gc
+        if self.flags & MEMORY:
+            result['memory'] = self.memory
+        return result
@@ -0,0 +1,133 @@
+# Django middleware.
+import re
+from contextlib import ExitStack
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+
+from optimize_later.batching import batch_reports
+from optimize_later.core import optimize_later, OptimizeBlock
+
+_placeholder_list = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+_whitespace = re.compile(r'\s+')
+
+
+def query_shape(sql):
+    """Normalize SQL so that queries differing only in the length of IN (...) lists compare equal."""
+    return _whitespace.sub(' ', _placeholder_list.sub('(%s, ...)', sql)).strip()
+
+
+class QueryBlock(OptimizeBlock):
+    """A block covering every execution of one query shape, possibly many times."""
+
+    __slots__ = ('sql', 'count', 'total')
+
+    def __init__(self, sql):
+        super(QueryBlock, self).__init__('SQL')
+        self.sql = sql
+        self.count = 0
+        self.total = 0.0
+
+    @property
+    def delta(self):
+        return self.total
+
+    def add(self, start, end):
+        if self.start is None:
+            self.start = start
+        self.end = end
+        self.count += 1
+        self.total += end - start
+
+    def to_dict(self):
+        result = super(QueryBlock, self).to_dict()
+        result.update(sql=self.sql, count=self.count)
+        return result
+
+    def short(self, precision=3):
+        return 'Query %r executed %d time%s, took %.*fs' % (
+            self.sql, self.count, '' if self.count == 1 else 's', precision, self.total,
+        )
+
+
+class QueryRecorder(object):
+    """A database execute wrapper that records queries as child blocks of an optimize_later."""
+
+    def __init__(self, timer):
+        self.timer = timer
+        self.queries = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record(sql, start, perf_counter())
+
+    def record(self, sql, start, end):
+        shape = query_shape(sql)
+        block = self.queries.get(shape)
+        if block is None:
+            block = self.queries[shape] = QueryBlock(shape)
+            if self.timer.blocks is None:
+                self.timer.blocks = []
+            self.timer.blocks.append(block)
+        block.add(start, end)
+
+
+class OptimizeLaterMiddleware(object):
+    """Times every request, named after the resolved view.
+
+    Requests that do not resolve to a view, such as 404s, are all named unresolved_name, so that arbitrary
+    paths do not each become a block name.
+
+    Settings:
+      - OPTIMIZE_LATER_DEFAULT_LIMIT: limit for views without a specific limit, 1 second by default.
+      - OPTIMIZE_LATER_VIEW_LIMITS: dictionary mapping URL names (e.g. 'app:view') to limits.
+      - OPTIMIZE_LATER_QUERY_BLOCKS: whether to record SQL queries as child blocks, True by default.
+      - OPTIMIZE_LATER_BATCH_REQUESTS: whether to dispatch all reports made during a request as one ReportBatch,
+        annotated with the request path and method, False by default.
+    """
+
+    unresolved_name = 'unresolved'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.default_limit = getattr(settings, 'OPTIMIZE_LATER_DEFAULT_LIMIT', 1)
+        self.view_limits = getattr(settings, 'OPTIMIZE_LATER_VIEW_LIMITS', None) or {}
+        self.query_blocks = getattr(settings, 'OPTIMIZE_LATER_QUERY_BLOCKS', True)
+        self.batch_requests = getattr(settings, 'OPTIMIZE_LATER_BATCH_REQUESTS', False)
+
+    def __call__(self, request):
+        timer = optimize_later(self.unresolved_name, self.view_limits.get(self.unresolved_name, self.default_limit))
+        request.optimize_later = timer
+        if not self.batch_requests:
+            return self.time_request(request, timer)
+
+        with batch_reports(self.unresolved_name, path=request.path, method=request.method) as batch:
+            response = self.time_request(request, timer)
+            batch.name, batch.limit = timer.name, timer.limit
+        return response
+
+    def time_request(self, request, timer):
+        with timer, ExitStack() as stack:
+            if self.query_blocks and timer.start is not None:
+                recorder = QueryRecorder(timer)
+                for connection in connections.all():
+                    if hasattr(connection, 'execute_wrapper'):
+                        stack.enter_context(connection.execute_wrapper(recorder))
+            return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timer = getattr(request, 'optimize_later', None)
+        if timer is None:
+            return
+
+        match = request.resolver_match
+        if match is not None and match.url_name:
+            name = match.view_name
+        else:
+            name = '%s:%s' % (view_func.__module__, getattr(view_func, '__name__', type(view_func).__name__))
+        # Overrides for the view name apply over the view limit.
+        timer.rename(name, self.view_limits.get(name, self.default_limit))
@@ -0,0 +1,176 @@
+"""Runtime configuration: a global kill switch, and limit, sampling and callback overrides by block name.
+
+The configuration is a dictionary, usually loaded from JSON:
+
+    {
+        "enabled": true,
+        "names": {
+            "myapp.views:*": {"limit": 0.5, "sample_rate": 0.1},
+            "myapp.export:*": {"enabled": false},
+            "checkout": {"limit": 0.2, "callbacks": ["myapp.alerts.page_oncall"]}
+        }
+    }
+
+Names are matched exactly first, then against glob patterns in the order given. Only the first matching
+entry applies. Callbacks are import paths or callables, and replace all other callbacks for matching reports.
+"""
+import json
+import logging
+import os
+import re
+from fnmatch import translate
+from importlib import import_module
+
+from optimize_later import config
+from optimize_later.routing import CallbackList
+from optimize_later.sampling import RandomSampler
+from optimize_later.utils import register_after_fork
+
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
+log = logging.getLogger(__name__.rpartition('.')[0] or __name__)
+
+ENVIRONMENT_VARIABLE = 'OPTIMIZE_LATER_CONFIG'
+
+
+def _import_string(path):
+    module, _, name = path.rpartition('.')
+    return getattr(import_module(module), name)
+
+
+class Rule(object):
+    __slots__ = ('enabled', 'limit', 'sampler', 'callbacks')
+
+    def __init__(self, enabled=True, limit=None, sample_rate=None, callbacks=None):
+        self.enabled = enabled
+        self.limit = limit
+        self.sampler = None if sample_rate is None else RandomSampler(sample_rate)
+        self.callbacks = None if callbacks is None else CallbackList(
+            _import_string(callback) if isinstance(callback, str) else callback for callback in callbacks
+        )
+
+
+class Overrides(object):
+    """Rules by block name or glob pattern, compiled into a dictionary of exact names and a single regex.
+
+    Lookups are cached per name, so that each block name is only matched against the patterns once.
+    """
+
+    def __init__(self, rules, cache_size=4096):
+        self._exact = {}
+        self._patterns = []
+        regexes = []
+        for pattern, rule in rules.items():
+            if not isinstance(rule, Rule):
+                rule = Rule(**rule)
+            if any(char in pattern for char in '*?['):
+                regexes.append('(?P<_%d>%s)' % (len(self._patterns), translate(pattern)))
+                self._patterns.append(rule)
+            else:
+                self._exact[pattern] = rule
+        self._regex = re.compile('|'.join(regexes)) if regexes else None
+        self._cache = {}
+        self._cache_size = cache_size
+
+    def get(self, name):
+        """Return the Rule for name, or None."""
+        try:
+            return self._cache[name]
+        except KeyError:
+            pass
+
+        rule = self._exact.get(name)
+        if rule is None and self._regex is not None:
+            match = self._regex.match(name)
+            if match is not None:
+                rule = self._patterns[int(match.lastgroup[1:])]
+
+        if len(self._cache) >= self._cache_size:
+            self._cache.clear()
+        self._cache[name] = rule
+        return rule
+
+
+def load(data):
+    """Apply a configuration dictionary, replacing the previous one."""
+    names = data.get('names')
+    overrides = Overrides(names) if names else None
+    config.set_enabled(data.get('enabled', True))
+    config.set_overrides(overrides)
+
+
+def load_file(path):
+    with open(path) as f:
+        load(json.load(f))
+
+
+class ConfigWatcher(object):
+    """Reloads a JSON configuration file whenever it changes, checking every interval seconds.
+
+    Invalid files are logged and ignored, keeping the previous configuration.
+    """
+
+    def __init__(self, path, interval=5):
+        self.path = path
+        self.interval = interval
+        self._stamp = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def check(self):
+        """Reload the file if it changed since the last check. Returns whether it was reloaded."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            log.warning('Cannot read optimize_later configuration: %s', self.path)
+            return False
+        stamp = stat.st_mtime, stat.st_size
+        if stamp == self._stamp:
+            return False
+        self._stamp = stamp
+        try:
+            load_file(self.path)
+        except Exception:
+            log.exception('Failed to load optimize_later configuration: %s', self.path)
+            return False
+        return True
+
+    def start(self):
+        self.check()
+        self._start_thread()
+        # Threads do not survive fork(), so pre-fork servers need a new watcher in each child.
+        register_after_fork(self, ConfigWatcher._start_thread)
+        return self
+
+    def _start_thread(self):
+        self._thread = threading.Thread(target=self._run, name='optimize-later-config')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.check()
+
+    def stop(self):
+        self._stopped.set()
+
+
+def configure(source=None, interval=5):
+    """Load configuration from a dictionary, a JSON string, or a file path, which is then watched for changes.
+
+    Without a source, the OPTIMIZE_LATER_CONFIG environment variable is used, if set. Returns the
+    ConfigWatcher for file paths.
+    """
+    if source is None:
+        source = os.environ.get(ENVIRONMENT_VARIABLE)
+        if not source:
+            return None
+    if isinstance(source, dict):
+        load(source)
+    elif source.lstrip().startswith('{'):
+        load(json.loads(source))
+    else:
+        return ConfigWatcher(source, interval).start()
@@ -0,0 +1,108 @@
+import os
+import sys
+
+from optimize_later.watchdog import Watchdog
+
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
+
+class ProfileSession(object):
+    __slots__ = ('thread', 'timer', 'stacks', 'samples', 'stopped')
+
+    def __init__(self, thread):
+        self.thread = thread
+        self.timer = None
+        self.stacks = None
+        self.samples = 0
+        self.stopped = False
+
+
+class StackProfiler(object):
+    """Samples the stack of threads running blocks that have used up `threshold` of their limit.
+
+    Sampling starts on a background thread once a block passes the threshold, and stops when it exits,
+    so blocks finishing in time are never sampled. Samples are aggregated as collapsed stacks.
+    """
+
+    def __init__(self, interval=0.005, threshold=1.0, max_depth=128, watchdog=None):
+        self.interval = interval
+        self.threshold = threshold
+        self.max_depth = max_depth
+        self.watchdog = watchdog if watchdog is not None else Watchdog()
+        self._sessions = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+        self._pid = None
+        self._names = {}
+
+    def schedule(self, deadline, thread):
+        session = ProfileSession(thread)
+        session.timer = self.watchdog.schedule(deadline, self._start, session)
+        return session
+
+    def stop(self, session):
+        """Stop sampling the session, returning the collapsed stacks or None if it was never sampled."""
+        self.watchdog.cancel(session.timer)
+        with self._lock:
+            session.stopped = True
+            if session.stacks is not None:
+                self._sessions.remove(session)
+        return session.stacks
+
+    def _start(self, session):
+        with self._lock:
+            if session.stopped:
+                return
+            session.stacks = {}
+            self._sessions.append(session)
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='optimize-later-profiler')
+                self._thread.daemon = True
+                self._thread.start()
+            else:
+                self._wakeup.notify()
+            self._sample([session], sys._current_frames())
+
+    def _run(self):
+        # Sampling holds the lock, so no samples are added to a session once stop() returns.
+        with self._lock:
+            while True:
+                while not self._sessions:
+                    self._wakeup.wait()
+                self._sample(self._sessions, sys._current_frames())
+                self._wakeup.wait(self.interval)
+
+    def _sample(self, sessions, frames):
+        for session in sessions:
+            frame = frames.get(session.thread)
+            if frame is None:
+                continue
+            key = self._collapse(frame)
+            stacks = session.stacks
+            stacks[key] = stacks.get(key, 0) + 1
+            session.samples += 1
+
+    def _frame_name(self, code):
+        try:
+            return self._names[code]
+        except KeyError:
+            name = self._names[code] = '%s:%s' % (os.path.basename(code.co_filename), code.co_name)
+            return name
+
+    def _collapse(self, frame):
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            names.append(self._frame_name(frame.f_code))
+            frame = frame.f_back
+        names.reverse()
+        return ';'.join(names)
+
+
+def format_collapsed(stacks):
+    """Format collapsed stacks, one per line, as understood by flamegraph.pl and speedscope."""
+    return '\n'.join('%s %d' % (stack, count) for stack, count in sorted(stacks.items()))
@@ -0,0 +1,132 @@
+import re
+from copy import copy
+from fnmatch import translate
+from itertools import count
+from time import time
+
+
+def _count_blocks(blocks):
+    return sum(1 + _count_blocks(block._blocks or ()) for block in blocks)
+
+
+def _truncate_blocks(blocks, budget):
+    # Keeps the first blocks in depth-first order, copying them so that the original tree is untouched.
+    result = []
+    for block in blocks:
+        if budget[0] <= 0:
+            break
+        budget[0] -= 1
+        clone = copy(block)
+        if block._blocks:
+            clone._blocks = _truncate_blocks(block._blocks, budget)
+        result.append(clone)
+    return result
+
+
+class RecentReports(object):
+    """A callback keeping the last capacity reports in a fixed-size ring buffer, for later inspection.
+
+    Recording takes no lock. Each report is stored as a copy with at most max_blocks blocks, keeping the
+    first ones in depth-first order, and at most max_stacks of its most sampled profiler stacks. The number
+    of blocks left out is stored in report.truncated_blocks. Reports in a ReportBatch are stored one by one.
+    """
+
+    def __init__(self, capacity=100, max_blocks=200, max_stacks=50):
+        self.capacity = capacity
+        self.max_blocks = max_blocks
+        self.max_stacks = max_stacks
+        self._slots = [None] * capacity
+        self._counter = count()
+
+    def __call__(self, report):
+        reports = getattr(report, 'reports', None)
+        if reports is not None:
+            for report in reports:
+                self(report)
+            return
+        # next() on a count is atomic, so concurrent callers always get distinct slots.
+        sequence = next(self._counter)
+        self._slots[sequence % self.capacity] = (sequence, time(), self._cap(report))
+
+    def _cap(self, report):
+        report = copy(report)
+        total = _count_blocks(report.blocks)
+        if total > self.max_blocks:
+            report.blocks = _truncate_blocks(report.blocks, [self.max_blocks])
+        report.truncated_blocks = max(total - self.max_blocks, 0)
+        if report.stacks and len(report.stacks) > self.max_stacks:
+            report.stacks = dict(sorted(report.stacks.items(), key=lambda item: -item[1])[:self.max_stacks])
+        # The in-progress report would keep a second block tree alive.
+        report.in_progress_report = None
+        return report
+
+    def _entries(self):
+        # Newest first. Slots written concurrently may show either the old or the new report.
+        entries = [entry for entry in self._slots if entry is not None]
+        entries.sort(key=lambda entry: -entry[0])
+        return [(timestamp, report) for sequence, timestamp, report in entries]
+
+    @property
+    def count(self):
+        """The number of reports stored. Not __len__, so that an empty buffer is still a true callback."""
+        return sum(1 for entry in self._slots if entry is not None)
+
+    def query(self, name=None, since=None, until=None, min_overage=None, limit=None):
+        """Return stored reports, newest first, as (time, report) pairs.
+
+        name is a glob pattern, since and until are time.time() values, and min_overage is the minimum number
+        of seconds over the limit.
+        """
+        match = re.compile(translate(name)).match if name is not None else None
+        result = []
+        for entry in self._entries():
+            timestamp, report = entry
+            if since is not None and timestamp < since or until is not None and timestamp > until:
+                continue
+            if match is not None and match(report.name) is None:
+                continue
+            if min_overage is not None and report.delta - (report.limit or 0) < min_overage:
+                continue
+            result.append(entry)
+            if limit is not None and len(result) >= limit:
+                break
+        return result
+
+    def recent(self, limit=10, **kwargs):
+        """Return the most recent reports matching query(), newest first."""
+        return [report for timestamp, report in self.query(limit=limit, **kwargs)]
+
+    def worst(self, limit=10, **kwargs):
+        """Return the reports matching query() that are furthest over their limit, worst first."""
+        reports = [report for timestamp, report in self.query(**kwargs)]
+        reports.sort(key=lambda report: (report.limit or 0) - report.delta)
+        return reports[:limit]
+
+    def clear(self):
+        self._slots = [None] * self.capacity
+
+
+def recent_reports_view(recent, limit=10):
+    """Return a Django view showing the most recent and worst reports in a RecentReports, for staff only.
+
+    The name, min_overage and limit query parameters filter the reports shown.
+    """
+    from django.contrib.auth.decorators import user_passes_test
+    from django.http import HttpResponse, HttpResponseBadRequest
+
+    @user_passes_test(lambda user: user.is_active and user.is_staff)
+    def view(request):
+        kwargs = {'name': request.GET.get('name') or None}
+        try:
+            kwargs['limit'] = int(request.GET.get('limit', limit))
+            if request.GET.get('min_overage'):
+                kwargs['min_overage'] = float(request.GET['min_overage'])
+        except ValueError:
+            return HttpResponseBadRequest('Invalid limit or min_overage.', content_type='text/plain')
+
+        lines = ['Most recent reports:', '']
+        lines += [report.long() for report in recent.recent(**kwargs)] or ['(none)']
+        lines += ['', 'Worst reports:', '']
+        lines += [report.long() for report in recent.worst(**kwargs)] or ['(none)']
+        return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; charset=utf-8')
+    return view
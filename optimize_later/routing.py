@@ -0,0 +1,172 @@
+import re
+from fnmatch import translate
+
+
+class RoutedCallback(object):
+    """A callback only interested in reports whose name matches a glob pattern, and that exceed their limit
+    by at least min_overage seconds.
+
+    Registered with register_callback(callback, pattern=..., min_overage=...). When invoked through
+    global_callback, reports are routed by CallbackIndex, and the callback is never called for others.
+    """
+
+    __slots__ = ('callback', 'pattern', 'min_overage', '_regex')
+
+    def __init__(self, callback, pattern=None, min_overage=None):
+        self.callback = callback
+        self.pattern = pattern
+        self.min_overage = min_overage
+        self._regex = None if pattern is None else re.compile(translate(pattern))
+
+    def matches(self, report):
+        if self.min_overage is not None and report.delta - (report.limit or 0) < self.min_overage:
+            return False
+        return self._regex is None or self._regex.match(report.name) is not None
+
+    def __call__(self, report):
+        if self.matches(report):
+            self.callback(report)
+
+    def __eq__(self, other):
+        if not isinstance(other, RoutedCallback):
+            return NotImplemented
+        return (self.callback, self.pattern, self.min_overage) == (other.callback, other.pattern, other.min_overage)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        return hash((self.callback, self.pattern, self.min_overage))
+
+    def __repr__(self):
+        return 'RoutedCallback(%r, pattern=%r, min_overage=%r)' % (self.callback, self.pattern, self.min_overage)
+
+
+def _is_prefix(pattern):
+    return pattern.endswith('*') and not any(char in pattern[:-1] for char in '*?[')
+
+
+class CallbackIndex(object):
+    """Routes reports to the callbacks of a callback list that match their name.
+
+    Exact names are looked up in a dictionary and patterns of the form 'prefix*' in a prefix trie. Other
+    glob patterns are tried in turn. The result is cached per block name, in registration order, so each
+    name goes through the index once.
+    """
+
+    def __init__(self, callbacks, cache_size=4096):
+        self._all = []
+        self._exact = {}
+        self._trie = {}
+        self._globs = []
+
+        for position, callback in enumerate(callbacks):
+            if not isinstance(callback, RoutedCallback):
+                self._all.append((position, callback, None))
+                continue
+            route = (position, callback.callback, callback.min_overage)
+            pattern = callback.pattern
+            if pattern is None:
+                self._all.append(route)
+            elif _is_prefix(pattern):
+                node = self._trie
+                for char in pattern[:-1]:
+                    node = node.setdefault(char, {})
+                node.setdefault(None, []).append(route)
+            elif any(char in pattern for char in '*?['):
+                self._globs.append((callback._regex, route))
+            else:
+                self._exact.setdefault(pattern, []).append(route)
+
+        self._cache = {}
+        self._cache_size = cache_size
+
+    def get(self, name):
+        """Return the (callback, min_overage) pairs interested in reports named name."""
+        try:
+            return self._cache[name]
+        except KeyError:
+            pass
+
+        routes = list(self._all)
+        routes += self._exact.get(name, ())
+
+        node = self._trie
+        routes += node.get(None, ())
+        for char in name:
+            node = node.get(char)
+            if node is None:
+                break
+            routes += node.get(None, ())
+
+        routes += [route for regex, route in self._globs if regex.match(name)]
+
+        routes.sort(key=lambda route: route[0])
+        result = tuple((callback, min_overage) for position, callback, min_overage in routes)
+        if len(self._cache) >= self._cache_size:
+            self._cache.clear()
+        self._cache[name] = result
+        return result
+
+    def route(self, report):
+        """Yield the callbacks to invoke for report."""
+        routes = self.get(report.name)
+        overage = None
+        for callback, min_overage in routes:
+            if min_overage is not None:
+                if overage is None:
+                    overage = report.delta - (report.limit or 0)
+                if overage < min_overage:
+                    continue
+            yield callback
+
+
+def _invalidating(name):
+    method = getattr(list, name)
+
+    def wrapper(self, *args, **kwargs):
+        self._index = None
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+
+class CallbackList(list):
+    """A list of callbacks that keeps its CallbackIndex, built on first use and dropped on every change.
+
+    The callback lists of config and optimize_context are CallbackLists, so the index lives exactly as long
+    as the list it indexes.
+    """
+
+    __slots__ = ('_index',)
+
+    def __init__(self, callbacks=()):
+        super(CallbackList, self).__init__(callbacks)
+        self._index = None
+
+    __setitem__ = _invalidating('__setitem__')
+    __delitem__ = _invalidating('__delitem__')
+    __iadd__ = _invalidating('__iadd__')
+    __imul__ = _invalidating('__imul__')
+    append = _invalidating('append')
+    extend = _invalidating('extend')
+    insert = _invalidating('insert')
+    pop = _invalidating('pop')
+    remove = _invalidating('remove')
+    clear = _invalidating('clear')
+    sort = _invalidating('sort')
+    reverse = _invalidating('reverse')
+
+    def __reduce__(self):
+        return CallbackList, (list(self),)
+
+
+def get_index(callbacks):
+    """Return the CallbackIndex for a list of callbacks, cached on the list if it is a CallbackList."""
+    if not isinstance(callbacks, CallbackList):
+        return CallbackIndex(callbacks)
+    index = callbacks._index
+    if index is None:
+        index = callbacks._index = CallbackIndex(callbacks)
+    return index
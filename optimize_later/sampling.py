@@ -0,0 +1,24 @@
+from itertools import count
+from random import random
+
+
+class CountingSampler(object):
+    """Deterministically samples one entry in every n."""
+
+    def __init__(self, n):
+        self.n = n
+        self.rate = 1.0 / n
+        self._counter = count()
+
+    def __call__(self):
+        return not next(self._counter) % self.n
+
+
+class RandomSampler(object):
+    """Samples each entry independently with probability rate."""
+
+    def __init__(self, rate):
+        self.rate = rate
+
+    def __call__(self):
+        return random() < self.rate
@@ -0,0 +1,246 @@
+"""Host-wide latency statistics for pre-fork servers, kept in a memory-mapped file.
+
+Every process writes only to its own worker slot, so recording takes no locks. Readers merge all slots.
+
+Usage: python -m optimize_later.shm /path/to/stats-file
+"""
+import errno
+import mmap
+import os
+import struct
+import sys
+
+from optimize_later.stats import BUCKET_COUNT, LatencyHistogram, bucket_index
+from optimize_later.utils import register_after_fork
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
+# Version 2 widened buckets to 64 bits.
+MAGIC = b'OPTLATR2'
+HEADER = struct.Struct('<8sIIII')
+HEADER_SIZE = 64
+SLOT_HEADER = struct.Struct('<q')
+SLOT_HEADER_SIZE = 64
+NAME_SIZE = 104
+
+# Entry layout: count, total, max as doubles, the UTF-8 name padded with NULs, then uint64 buckets. Slots are
+# adopted across restarts, so 32-bit buckets could overflow on long-lived hosts.
+ENTRY_VALUES_SIZE = 24
+ENTRY_HEADER_SIZE = ENTRY_VALUES_SIZE + NAME_SIZE
+ENTRY_SIZE = ENTRY_HEADER_SIZE + BUCKET_COUNT * 8
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class SharedStats(object):
+    """Per-name latency histograms shared between processes through a memory-mapped file.
+
+    Register with config.register_recorder(stats.record). Each process claims one of `workers` slots,
+    which holds up to `names` block names; names beyond that are counted in `dropped`. Claiming the slot and
+    adding a name take a lock, so that threads of one process do not take the same entry; recording a name
+    already added does not.
+    """
+
+    def __init__(self, path, workers=64, names=128):
+        self.path = path
+        self.workers = workers
+        self.names = names
+        self.dropped = 0
+        self._slot_size = SLOT_HEADER_SIZE + names * ENTRY_SIZE
+        self._pid = None
+        self._slot = None
+        self._entries = {}
+        self._allocation_lock = threading.Lock()
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            size = HEADER_SIZE + workers * self._slot_size
+            self._lock(fd)
+            try:
+                os.lseek(fd, 0, os.SEEK_SET)
+                header = os.read(fd, HEADER.size)
+                if len(header) == HEADER.size and header[:8] == MAGIC:
+                    magic, bucket_count, entry_size, workers, names = HEADER.unpack(header)
+                    if bucket_count != BUCKET_COUNT or entry_size != ENTRY_SIZE:
+                        raise ValueError('Incompatible statistics file: %s' % (path,))
+                    self.workers, self.names = workers, names
+                    self._slot_size = SLOT_HEADER_SIZE + names * ENTRY_SIZE
+                else:
+                    # Clear files from other versions, whose slots have a different layout.
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, size)
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    os.write(fd, HEADER.pack(MAGIC, BUCKET_COUNT, ENTRY_SIZE, workers, names))
+            finally:
+                self._unlock(fd)
+            self._map = mmap.mmap(fd, HEADER_SIZE + self.workers * self._slot_size)
+        finally:
+            os.close(fd)
+        self._view = memoryview(self._map)
+
+        # Forked children must claim their own slot. Checking os.getpid() on every record is a system call,
+        # so it is only done on Python versions that cannot tell us about forks.
+        self._check_pid = not register_after_fork(self, SharedStats._forget_slot)
+
+    def _forget_slot(self):
+        self._pid = None
+        # Another thread may have held the lock when the process forked.
+        self._allocation_lock = threading.Lock()
+
+    @staticmethod
+    def _lock(fd):
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+
+    @staticmethod
+    def _unlock(fd):
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _slot_offset(self, slot):
+        return HEADER_SIZE + slot * self._slot_size
+
+    def _entry_offset(self, slot, index):
+        return self._slot_offset(slot) + SLOT_HEADER_SIZE + index * ENTRY_SIZE
+
+    def _claim_slot(self):
+        pid = os.getpid()
+        fd = os.open(self.path, os.O_RDWR)
+        try:
+            self._lock(fd)
+            try:
+                for slot in range(self.workers):
+                    owner, = SLOT_HEADER.unpack_from(self._map, self._slot_offset(slot))
+                    if owner == pid or not owner or not _pid_alive(owner):
+                        # Adopting the slot of a dead worker keeps its counts in the host-wide totals.
+                        SLOT_HEADER.pack_into(self._map, self._slot_offset(slot), pid)
+                        break
+                else:
+                    slot = None
+            finally:
+                self._unlock(fd)
+        finally:
+            os.close(fd)
+
+        entries = {}
+        if slot is not None:
+            for index in range(self.names):
+                name = self._read_name(slot, index)
+                if name:
+                    entries[name] = self._entry_views(slot, index)
+        # Set the pid last, as record() only takes the lock until it is set.
+        self._slot = slot
+        self._entries = entries
+        self._pid = pid
+
+    def _read_name(self, slot, index):
+        offset = self._entry_offset(slot, index) + ENTRY_VALUES_SIZE
+        return bytes(self._map[offset:offset + NAME_SIZE]).rstrip(b'\0').decode('utf-8', 'replace')
+
+    def _entry_views(self, slot, index):
+        offset = self._entry_offset(slot, index)
+        return (self._view[offset:offset + ENTRY_VALUES_SIZE].cast('d'),
+                self._view[offset + ENTRY_HEADER_SIZE:offset + ENTRY_SIZE].cast('Q'))
+
+    def _allocate(self, name):
+        if self._slot is None or len(self._entries) >= self.names:
+            return None
+        index = len(self._entries)
+        encoded = name.encode('utf-8')[:NAME_SIZE]
+        offset = self._entry_offset(self._slot, index) + ENTRY_VALUES_SIZE
+        self._map[offset:offset + NAME_SIZE] = encoded.ljust(NAME_SIZE, b'\0')
+        views = self._entries[name] = self._entry_views(self._slot, index)
+        return views
+
+    def record(self, name, delta):
+        if self._pid is None or self._check_pid and self._pid != os.getpid():
+            with self._allocation_lock:
+                if self._pid is None or self._pid != os.getpid():
+                    self._claim_slot()
+        try:
+            values, buckets = self._entries[name]
+        except KeyError:
+            with self._allocation_lock:
+                views = self._entries.get(name) or self._allocate(name)
+                if views is None:
+                    self.dropped += 1
+                    return
+            values, buckets = views
+
+        buckets[bucket_index(delta)] += 1
+        values[1] += delta
+        if delta > values[2]:
+            values[2] = delta
+        values[0] += 1
+
+    def snapshot(self):
+        """Return a dictionary mapping block names to histograms merged across all workers."""
+        result = {}
+        for slot in range(self.workers):
+            owner, = SLOT_HEADER.unpack_from(self._map, self._slot_offset(slot))
+            if not owner:
+                continue
+            for index in range(self.names):
+                name = self._read_name(slot, index)
+                if not name:
+                    break
+                values, buckets = self._entry_views(slot, index)
+                histogram = LatencyHistogram()
+                histogram.buckets = buckets.tolist()
+                histogram.count = int(values[0])
+                histogram.total = values[1]
+                histogram.max = values[2]
+                values.release()
+                buckets.release()
+                if name in result:
+                    result[name].merge(histogram)
+                else:
+                    result[name] = histogram
+        return result
+
+    def summary(self):
+        return {name: histogram.summary() for name, histogram in self.snapshot().items()}
+
+    def reset(self):
+        """Clear every worker slot. Only safe while no process is recording."""
+        self._map[HEADER_SIZE:] = b'\0' * (len(self._map) - HEADER_SIZE)
+        self._pid = None
+
+
+def format_summary(summary):
+    lines = ['%-40s %10s %10s %10s %10s %10s %10s' % ('name', 'count', 'mean', 'p50', 'p90', 'p99', 'max')]
+    for name, stats in sorted(summary.items(), key=lambda item: -item[1]['count']):
+        lines.append('%-40s %10d %10.6f %10.6f %10.6f %10.6f %10.6f' % (
+            name, stats['count'], stats['mean'], stats['p50'], stats['p90'], stats['p99'], stats['max'],
+        ))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print('Usage: python -m optimize_later.shm <stats file>', file=sys.stderr)
+        return 2
+    if not os.path.exists(argv[0]):
+        print('No such file: %s' % (argv[0],), file=sys.stderr)
+        return 1
+    print(format_summary(SharedStats(argv[0]).summary()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
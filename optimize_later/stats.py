@@ -0,0 +1,153 @@
+from math import frexp, ldexp
+
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
+# Each power of two between 2**MIN_EXPONENT and 2**MAX_EXPONENT seconds (~60ns to ~17 minutes)
+# is split into SUB_BUCKETS linear buckets, bounding the relative error of quantiles to ~6%.
+SUB_BUCKETS = 16
+MIN_EXPONENT = -23
+MAX_EXPONENT = 10
+BUCKET_COUNT = (MAX_EXPONENT - MIN_EXPONENT) * SUB_BUCKETS
+
+
+def bucket_index(value):
+    if value <= 0:
+        return 0
+    mantissa, exponent = frexp(value)
+    if exponent <= MIN_EXPONENT:
+        return 0
+    if exponent > MAX_EXPONENT:
+        return BUCKET_COUNT - 1
+    return (exponent - MIN_EXPONENT - 1) * SUB_BUCKETS + int((mantissa - 0.5) * (2 * SUB_BUCKETS))
+
+
+def bucket_bounds(index):
+    group, sub = divmod(index, SUB_BUCKETS)
+    exponent = group + MIN_EXPONENT + 1
+    return (ldexp((SUB_BUCKETS + sub) / (2.0 * SUB_BUCKETS), exponent),
+            ldexp((SUB_BUCKETS + sub + 1) / (2.0 * SUB_BUCKETS), exponent))
+
+
+class LatencyHistogram(object):
+    """A fixed-size log-linear histogram of durations in seconds."""
+
+    __slots__ = ('buckets', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.buckets = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.buckets[bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        buckets = self.buckets
+        for index, count in enumerate(other.buckets):
+            if count:
+                buckets[index] += count
+        self.count += other.count
+        self.total += other.total
+        if other.max > self.max:
+            self.max = other.max
+
+    def copy(self):
+        histogram = LatencyHistogram()
+        histogram.merge(self)
+        return histogram
+
+    def reset(self):
+        self.__init__()
+
+    def to_dict(self):
+        return {
+            'buckets': {index: count for index, count in enumerate(self.buckets) if count},
+            'count': self.count,
+            'total': self.total,
+            'max': self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        for index, count in data['buckets'].items():
+            histogram.buckets[int(index)] = count
+        histogram.count = data['count']
+        histogram.total = data['total']
+        histogram.max = data['max']
+        return histogram
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0.0
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min(bucket_bounds(index)[1], self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class StatsAggregator(object):
+    """Records every optimize_later exit into a histogram per block name.
+
+    Register with config.register_recorder(aggregator.record). Recording does not take a lock,
+    so counts may be slightly off when the same name is recorded from several threads at once.
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, delta):
+        try:
+            histogram = self._histograms[name]
+        except KeyError:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, LatencyHistogram())
+        histogram.record(delta)
+
+    def get(self, name):
+        histogram = self._histograms.get(name)
+        return histogram.copy() if histogram is not None else LatencyHistogram()
+
+    def names(self):
+        return list(self._histograms)
+
+    def snapshot(self, reset=False):
+        """Return a dictionary mapping block names to copies of their histograms."""
+        with self._lock:
+            histograms = self._histograms
+            if reset:
+                self._histograms = {}
+        return {name: histogram.copy() for name, histogram in list(histograms.items())}
+
+    def summary(self):
+        return {name: histogram.summary() for name, histogram in self.snapshot().items()}
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
@@ -0,0 +1,29 @@
+# Tests using asynchronous generator syntax, only imported by test_standard on Python 3.6 and later.
+import asyncio
+from unittest import TestCase
+
+from optimize_later.core import optimize_later
+
+
+class AsyncGeneratorTest(TestCase):
+    def test_async_generator(self):
+        reports = []
+
+        @optimize_later(callback=reports.append)
+        async def generator():
+            for i in range(2):
+                await asyncio.sleep(0.01)
+                yield i
+
+        async def main():
+            return [item async for item in generator()]
+
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertEqual(loop.run_until_complete(main()), [0, 1])
+        finally:
+            loop.close()
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0].generator.items, 2)
+        self.assertGreaterEqual(reports[0].delta, 0.02)
+
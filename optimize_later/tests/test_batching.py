@@ -0,0 +1,54 @@
+from unittest import TestCase
+
+from optimize_later.batching import batch_reports, ReportBatch
+from optimize_later.config import optimize_context
+from optimize_later.core import optimize_later
+
+
+class BatchReportsTest(TestCase):
+    def test_batch(self):
+        batches = []
+        with optimize_context([batches.append], reset=True):
+            with batch_reports('request', 1, path='/', method='GET') as batch:
+                with optimize_later('a'):
+                    pass
+                with optimize_later('b'):
+                    pass
+                self.assertEqual(batches, [])
+                batch.annotations['user'] = 'admin'
+
+        self.assertEqual(len(batches), 1)
+        batch = batches[0]
+        self.assertIsInstance(batch, ReportBatch)
+        self.assertEqual([report.name for report in batch.reports], ['a', 'b'])
+        self.assertEqual(batch.name, 'request')
+        self.assertEqual(batch.limit, 1)
+        self.assertGreaterEqual(batch.delta, batch.reports[0].delta + batch.reports[1].delta)
+        self.assertEqual(batch.short(), "Batch 'request' method=GET path=/ user=admin took %.3fs, with 2 slow reports"
+                         % (batch.delta,))
+        self.assertIn("Block 'b' took", batch.long())
+
+        data = batch.to_dict()
+        self.assertEqual(data['annotations'], {'path': '/', 'method': 'GET', 'user': 'admin'})
+        self.assertEqual(data['name'], 'request')
+        batch.annotations['delta'] = 'annotation'
+        self.assertEqual(batch.to_dict()['delta'], batch.delta)
+        self.assertEqual([report['name'] for report in data['reports']], ['a', 'b'])
+
+    def test_empty(self):
+        batches = []
+        with batch_reports('request', callback=batches.append):
+            with optimize_later('fast', float('inf')):
+                pass
+        self.assertEqual(batches, [])
+
+    def test_callback(self):
+        batches = []
+        reports = []
+        with optimize_context([reports.append], reset=True):
+            with batch_reports('task', callback=batches.append):
+                with optimize_later('a'):
+                    pass
+        self.assertEqual(reports, [])
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(len(batches[0].reports), 1)
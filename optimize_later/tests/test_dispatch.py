@@ -0,0 +1,76 @@
+import threading
+from unittest import TestCase
+
+from optimize_later.core import optimize_later, OptimizeReport
+from optimize_later.dispatch import AsyncDispatcher, DROP_NEWEST, DROP_OLDEST, BLOCK
+
+
+class AsyncDispatcherTest(TestCase):
+    def make_blocked_dispatcher(self, **kwargs):
+        gate = threading.Event()
+        started = threading.Event()
+        reports = []
+
+        def callback(report):
+            started.set()
+            gate.wait()
+            reports.append(report)
+
+        dispatcher = AsyncDispatcher(callback, **kwargs)
+        dispatcher(0)
+        started.wait()
+        return dispatcher, gate, reports
+
+    def test_dispatch(self):
+        reports = []
+        dispatcher = AsyncDispatcher(reports.append)
+        with optimize_later(callback=dispatcher):
+            pass
+        self.assertTrue(dispatcher.flush(5))
+        self.assertEqual(len(reports), 1)
+        self.assertIsInstance(reports[0], OptimizeReport)
+        self.assertEqual(dispatcher.dispatched, 1)
+        dispatcher.close()
+
+    def test_drop_oldest(self):
+        dispatcher, gate, reports = self.make_blocked_dispatcher(maxsize=2, overflow=DROP_OLDEST)
+        for i in range(1, 5):
+            dispatcher(i)
+        gate.set()
+        self.assertTrue(dispatcher.flush(5))
+        self.assertEqual(reports, [0, 3, 4])
+        self.assertEqual(dispatcher.dropped, 2)
+
+    def test_drop_newest(self):
+        dispatcher, gate, reports = self.make_blocked_dispatcher(maxsize=2, overflow=DROP_NEWEST)
+        for i in range(1, 5):
+            dispatcher(i)
+        gate.set()
+        self.assertTrue(dispatcher.flush(5))
+        self.assertEqual(reports, [0, 1, 2])
+        self.assertEqual(dispatcher.dropped, 2)
+
+    def test_block(self):
+        dispatcher, gate, reports = self.make_blocked_dispatcher(maxsize=1, overflow=BLOCK)
+        dispatcher(1)
+        thread = threading.Thread(target=dispatcher, args=(2,))
+        thread.start()
+        thread.join(0.05)
+        self.assertTrue(thread.is_alive())
+        gate.set()
+        thread.join()
+        self.assertTrue(dispatcher.flush(5))
+        self.assertEqual(reports, [0, 1, 2])
+        self.assertEqual(dispatcher.dropped, 0)
+
+    def test_close(self):
+        reports = []
+        dispatcher = AsyncDispatcher(reports.append)
+        dispatcher(1)
+        self.assertTrue(dispatcher.close())
+        dispatcher(2)
+        self.assertEqual(reports, [1])
+        self.assertEqual(dispatcher.dropped, 1)
+
+    def test_bad_policy(self):
+        self.assertRaises(ValueError, AsyncDispatcher, None, overflow='nope')
@@ -1,7 +1,11 @@
 import imp
 import sys
 import uuid
+from unittest import skipIf
 
+from optimize_later import config
+from optimize_later.batching import ReportBatch
+from optimize_later.config import optimize_context
 from optimize_later.core import optimize_later, OptimizeReport
 
 try:
@@ -12,8 +16,9 @@ else:
     use_django = settings.configured
 
 if use_django:
+    import django
     from django.test import TestCase
-    from optimize_later import apps
+    from optimize_later import apps, middleware
 
 
     class DjangoCallbackTest(TestCase):
@@ -38,3 +43,124 @@ if use_django:
                     pass
             self.assertEqual(len(reports), 1)
             self.assertIsInstance(reports[0], OptimizeReport)
+
+        def test_routed_callbacks(self):
+            reports = []
+            with self.settings(OPTIMIZE_LATER_CALLBACKS=[
+                {'callback': self.make_module_path(reports.append), 'pattern': 'app.*'},
+            ]):
+                apps.initialize_django_callbacks()
+                with optimize_later('app.view'):
+                    pass
+                with optimize_later('other'):
+                    pass
+            self.assertEqual([report.name for report in reports], ['app.view'])
+
+        def test_async_callbacks(self):
+            reports = []
+            with self.settings(OPTIMIZE_LATER_CALLBACKS=[
+                self.make_module_path(reports.append),
+            ], OPTIMIZE_LATER_ASYNC={'maxsize': 16}):
+                apps.initialize_django_callbacks()
+                with optimize_later('test'):
+                    pass
+                self.assertTrue(apps.django_dispatcher.flush(5))
+            apps.initialize_django_callbacks()
+            self.assertIs(apps.django_dispatcher, None)
+            self.assertEqual(len(reports), 1)
+            self.assertIsInstance(reports[0], OptimizeReport)
+
+
+    class RecentReportsViewTest(TestCase):
+        def test_view(self):
+            from django.contrib.auth.models import AnonymousUser, User
+            from django.test import RequestFactory
+            from optimize_later.recent import RecentReports, recent_reports_view
+
+            recent = RecentReports()
+            with optimize_later('slow-block', callback=recent):
+                pass
+            view = recent_reports_view(recent)
+
+            request = RequestFactory().get('/recent/')
+            request.user = AnonymousUser()
+            self.assertEqual(view(request).status_code, 302)
+
+            request.user = User.objects.create(username='staff', is_staff=True)
+            response = view(request)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b"Block 'slow-block' took", response.content)
+
+            request = RequestFactory().get('/recent/', {'min_overage': 'x'})
+            request.user = User.objects.get(username='staff')
+            self.assertEqual(view(request).status_code, 400)
+
+
+    class MiddlewareTest(TestCase):
+        def setUp(self):
+            from django.contrib.auth.models import Group, User
+
+            group = Group.objects.create(name='group')
+            for i in range(3):
+                User.objects.create(username='user%d' % (i,)).groups.add(group)
+
+        def get_reports(self, path):
+            reports = []
+            with optimize_context([reports.append], reset=True):
+                self.assertEqual(self.client.get(path).status_code, 200)
+            return reports
+
+        def test_fast_view(self):
+            with self.settings(OPTIMIZE_LATER_DEFAULT_LIMIT=float('inf')):
+                self.assertEqual(self.get_reports('/queries/'), [])
+
+        def test_view_limit(self):
+            with self.settings(OPTIMIZE_LATER_DEFAULT_LIMIT=0, OPTIMIZE_LATER_VIEW_LIMITS={'queries': float('inf')}):
+                self.assertEqual(self.get_reports('/queries/'), [])
+
+        def test_overrides(self):
+            from optimize_later.overrides import Overrides
+
+            for rules in ({'queries': {'enabled': False}}, {'queries': {'limit': 100}}):
+                config.set_overrides(Overrides(rules))
+                try:
+                    with self.settings(OPTIMIZE_LATER_DEFAULT_LIMIT=0):
+                        self.assertEqual(self.get_reports('/queries/'), [])
+                finally:
+                    config.set_overrides(None)
+
+        def test_unresolved(self):
+            reports = []
+            with self.settings(OPTIMIZE_LATER_DEFAULT_LIMIT=0), optimize_context([reports.append], reset=True):
+                for path in ('/missing/', '/missing/%s/' % (uuid.uuid4().hex,)):
+                    self.assertEqual(self.client.get(path).status_code, 404)
+            self.assertEqual([report.name for report in reports], ['unresolved', 'unresolved'])
+
+        @skipIf(django.VERSION < (2, 0), 'execute_wrapper requires Django 2.0')
+        def test_query_blocks(self):
+            with self.settings(OPTIMIZE_LATER_DEFAULT_LIMIT=0):
+                reports = self.get_reports('/queries/')
+            self.assertEqual(len(reports), 1)
+            self.assertEqual(reports[0].name, 'queries')
+
+            blocks = reports[0].blocks
+            self.assertEqual(len(blocks), 2)
+            self.assertIsInstance(blocks[0], middleware.QueryBlock)
+            self.assertEqual(blocks[0].count, 1)
+            self.assertEqual(blocks[1].count, 3)
+            self.assertIn('executed 3 times', reports[0].long())
+
+        def test_batch_requests(self):
+            with self.settings(OPTIMIZE_LATER_DEFAULT_LIMIT=0, OPTIMIZE_LATER_BATCH_REQUESTS=True):
+                batches = self.get_reports('/queries/')
+            self.assertEqual(len(batches), 1)
+            batch = batches[0]
+            self.assertIsInstance(batch, ReportBatch)
+            self.assertEqual(batch.name, 'queries')
+            self.assertEqual(batch.annotations, {'path': '/queries/', 'method': 'GET'})
+            self.assertEqual([report.name for report in batch.reports], ['queries'])
+            self.assertGreaterEqual(batch.delta, batch.reports[0].delta)
+
+        def test_query_shape(self):
+            self.assertEqual(middleware.query_shape('SELECT * FROM a WHERE id IN (%s, %s,%s)\n  AND b = %s'),
+                             'SELECT * FROM a WHERE id IN (%s, ...) AND b = %s')
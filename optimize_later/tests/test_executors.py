@@ -0,0 +1,102 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from unittest import TestCase
+
+from optimize_later import config
+from optimize_later.config import optimize_context
+from optimize_later.core import optimize_later, OptimizeBlock
+from optimize_later.executors import ContextExecutor, propagate
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def fail():
+    raise ValueError('failed')
+
+
+def nested(seconds):
+    with optimize_later('inner'):
+        time.sleep(seconds)
+    return seconds
+
+
+class ContextExecutorTest(TestCase):
+    def tearDown(self):
+        config.set_nesting(False)
+
+    def test_thread_callbacks(self):
+        reports = []
+
+        def work():
+            with optimize_later('worker'):
+                pass
+            return config.get_callbacks()
+
+        with ThreadPoolExecutor(1) as executor:
+            with optimize_context([reports.append], reset=True):
+                self.assertEqual(ContextExecutor(executor).submit(work).result(), [reports.append])
+            self.assertEqual(executor.submit(work).result(), config._global_callbacks)
+        self.assertEqual([report.name for report in reports], ['worker'])
+
+    def test_thread_blocks(self):
+        reports = []
+        with ThreadPoolExecutor(2) as pool:
+            with optimize_later('fanout', callback=reports.append) as o:
+                executor = ContextExecutor(pool, parent=o)
+                self.assertEqual(list(executor.map(sleep, [0.01, 0.02])), [0.01, 0.02])
+        self.assertEqual(len(reports), 1)
+        blocks = reports[0].blocks
+        self.assertEqual([block.name for block in blocks], ['%s:sleep' % (__name__,)] * 2)
+        self.assertGreaterEqual(blocks[0].delta, 0.01)
+        self.assertGreaterEqual(blocks[1].delta, 0.02)
+
+    def test_thread_nesting(self):
+        config.set_nesting(True)
+        reports = []
+        with ThreadPoolExecutor(1) as pool:
+            with optimize_later('fanout', callback=reports.append):
+                ContextExecutor(pool).submit(nested, 0).result()
+        self.assertEqual(len(reports), 1)
+        self.assertEqual([block.name for block in reports[0].blocks], ['%s:nested' % (__name__,)])
+        self.assertEqual([block.name for block in reports[0].blocks[0].blocks], ['inner'])
+
+    def test_propagate(self):
+        reports = []
+        with ThreadPoolExecutor(1) as executor:
+            with optimize_later('fanout', callback=reports.append) as o:
+                self.assertEqual(executor.submit(propagate(sleep, o), 0).result(), 0)
+        self.assertEqual(len(reports[0].blocks), 1)
+        self.assertIsNotNone(reports[0].blocks[0].end)
+
+    def test_process_blocks(self):
+        reports = []
+        with ProcessPoolExecutor(1) as pool:
+            with optimize_later('fanout', callback=reports.append) as o:
+                executor = ContextExecutor(pool, parent=o)
+                self.assertEqual(executor.submit(sleep, 0.01).result(), 0.01)
+                error = executor.submit(fail).exception()
+        self.assertIs(type(error), ValueError)
+        self.assertEqual(vars(error), {})
+        self.assertIn('in fail', str(error.__cause__))
+        blocks = reports[0].blocks
+        self.assertEqual([block.name for block in blocks], ['%s:sleep' % (__name__,), '%s:fail' % (__name__,)])
+        self.assertGreaterEqual(blocks[0].delta, 0.01)
+        self.assertIsNotNone(blocks[1].delta)
+
+    def test_process_callbacks(self):
+        with ProcessPoolExecutor(1) as pool:
+            with optimize_context([sleep, lambda report: None], reset=True):
+                future = ContextExecutor(pool).submit(config.get_callbacks)
+            self.assertEqual(future.result(), [sleep])
+
+    def test_from_dict(self):
+        with optimize_later('name') as o:
+            with o.block('a') as a:
+                with a.block('b'):
+                    pass
+        block = OptimizeBlock.from_dict(a.to_dict())
+        self.assertEqual(block.to_dict(), a.to_dict())
+        self.assertEqual(block.blocks[0].name, 'b')
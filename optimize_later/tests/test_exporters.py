@@ -0,0 +1,83 @@
+import socket
+from unittest import TestCase
+from wsgiref.util import setup_testing_defaults
+
+from optimize_later.core import optimize_later
+from optimize_later.exporters import render_prometheus, PrometheusApp, StatsdClient
+from optimize_later.stats import StatsAggregator
+
+
+class PrometheusTest(TestCase):
+    def setUp(self):
+        self.aggregator = StatsAggregator()
+        for delta in (0.001, 0.02, 0.02, 0.3, 20):
+            self.aggregator.record('block', delta)
+        self.aggregator.record('quote"d', 0.001)
+
+    def test_render(self):
+        text = render_prometheus(self.aggregator, buckets=(0.01, 0.1, 1))
+        self.assertIn('# TYPE optimize_later_duration_seconds histogram\n', text)
+        self.assertIn('optimize_later_duration_seconds_bucket{name="block",le="0.01"} 1\n', text)
+        self.assertIn('optimize_later_duration_seconds_bucket{name="block",le="0.1"} 3\n', text)
+        self.assertIn('optimize_later_duration_seconds_bucket{name="block",le="1"} 4\n', text)
+        self.assertIn('optimize_later_duration_seconds_bucket{name="block",le="+Inf"} 5\n', text)
+        self.assertIn('optimize_later_duration_seconds_count{name="block"} 5\n', text)
+        self.assertIn('optimize_later_duration_seconds_sum{name="block"} 20.341', text)
+        self.assertIn('{name="quote\\"d",le="+Inf"} 1\n', text)
+
+    def test_wsgi(self):
+        environ = {}
+        setup_testing_defaults(environ)
+        responses = []
+        body = b''.join(PrometheusApp(self.aggregator)(environ, lambda *args: responses.append(args)))
+        self.assertEqual(responses[0][0], '200 OK')
+        self.assertIn(b'optimize_later_duration_seconds_count{name="block"} 5', body)
+
+
+class StatsdClientTest(TestCase):
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.settimeout(5)
+        self.port = self.server.getsockname()[1]
+
+    def tearDown(self):
+        self.server.close()
+
+    def receive(self, client):
+        client.close()
+        packets = []
+        self.server.settimeout(0.1)
+        try:
+            while True:
+                packets.append(self.server.recv(65536).decode('utf-8'))
+        except socket.timeout:
+            pass
+        return packets
+
+    def test_batching(self):
+        client = StatsdClient(port=self.port, max_packet=100, flush_interval=60)
+        for i in range(10):
+            client.record('my block', 0.0125)
+
+        packets = self.receive(client)
+        lines = [line for packet in packets for line in packet.split('\n')]
+        self.assertEqual(lines, ['optimize_later.my_block:12.500|ms'] * 10)
+        self.assertLess(len(packets), 10)
+        self.assertTrue(all(len(packet) <= 100 for packet in packets))
+        self.assertEqual(client.packets, len(packets))
+
+    def test_dogstatsd_callback(self):
+        client = StatsdClient(port=self.port, dogstatsd=True)
+        with optimize_later('slow', callback=client):
+            pass
+        packets = self.receive(client)
+        self.assertEqual(len(packets), 1)
+        self.assertRegex(packets[0], r'^optimize_later\.duration:\d+\.\d{3}\|ms\|#name:slow$')
+
+    def test_overflow(self):
+        client = StatsdClient(port=self.port, max_buffer=2)
+        for i in range(3):
+            client.record('a', 0.001)
+        self.assertEqual(client.dropped, 1)
+        self.assertEqual(len(self.receive(client)), 1)
@@ -0,0 +1,141 @@
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import redirect_stderr, redirect_stdout
+from unittest import TestCase
+
+from optimize_later.__main__ import main
+from optimize_later.batching import batch_reports
+from optimize_later.core import optimize_later
+from optimize_later.jsonl import JSONLinesSink, open_reports
+
+
+class JSONLinesSinkTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'reports.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_reports(self, sink, count, name='block'):
+        for i in range(count):
+            with optimize_later(name, callback=sink) as o:
+                with o.block('outer') as b:
+                    with b.block('inner'):
+                        pass
+
+    def test_serialize(self):
+        sink = JSONLinesSink(self.path)
+        self.write_reports(sink, 2)
+        sink.close()
+
+        with open(self.path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertNotIn(', ', lines[0])
+
+        report = json.loads(lines[0])
+        self.assertEqual(report['name'], 'block')
+        self.assertEqual(report['limit'], 0)
+        self.assertIsInstance(report['time'], float)
+        self.assertEqual(report['blocks'][0]['name'], 'outer')
+        self.assertEqual(report['blocks'][0]['blocks'][0]['name'], 'inner')
+        self.assertNotIn('blocks', report['blocks'][0]['blocks'][0])
+
+    def test_buffered(self):
+        sink = JSONLinesSink(self.path, flush_interval=60)
+        self.write_reports(sink, 2)
+        self.assertEqual(os.path.getsize(self.path), 0)
+        sink.flush()
+        self.assertGreater(os.path.getsize(self.path), 0)
+        sink.close()
+
+    def test_flush_timer(self):
+        sink = JSONLinesSink(self.path, flush_interval=0.05)
+        self.write_reports(sink, 2)
+        self.assertEqual(os.path.getsize(self.path), 0)
+        deadline = time.time() + 5
+        while os.path.getsize(self.path) == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(list(open_reports(self.path))), 2)
+        sink.close()
+
+    def test_size_rotation(self):
+        sink = JSONLinesSink(self.path, max_bytes=1000, backups=2)
+        self.write_reports(sink, 20)
+        sink.close()
+
+        self.assertEqual(sorted(os.listdir(self.directory)), ['reports.jsonl', 'reports.jsonl.1', 'reports.jsonl.2'])
+        for name in os.listdir(self.directory):
+            self.assertLessEqual(os.path.getsize(os.path.join(self.directory, name)), 1000)
+
+    def test_large_lines(self):
+        sink = JSONLinesSink(self.path, max_bytes=10, backups=5)
+        self.write_reports(sink, 3)
+        sink.close()
+
+        self.assertEqual(sorted(os.listdir(self.directory)), ['reports.jsonl', 'reports.jsonl.1', 'reports.jsonl.2'])
+        for name in os.listdir(self.directory):
+            self.assertEqual(len(list(open_reports(os.path.join(self.directory, name)))), 1)
+
+    def test_time_rotation_gzip(self):
+        sink = JSONLinesSink(self.path, max_age=0.01, compress=True)
+        self.write_reports(sink, 1)
+        time.sleep(0.02)
+        self.write_reports(sink, 1)
+        sink.close()
+
+        self.assertEqual(sorted(os.listdir(self.directory)), ['reports.jsonl', 'reports.jsonl.1.gz'])
+        with gzip.open(self.path + '.1.gz', 'rt') as f:
+            self.assertEqual(len(f.read().splitlines()), 1)
+        self.assertEqual(len(list(open_reports(self.path + '.1.gz'))), 1)
+        self.assertEqual(len(list(open_reports(self.path))), 1)
+
+    def test_cli(self):
+        sink = JSONLinesSink(self.path)
+        self.write_reports(sink, 3, name='first')
+        self.write_reports(sink, 1, name='second')
+        sink.close()
+
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            self.assertEqual(main([self.path, '--top', '5']), 0)
+        output = stdout.getvalue()
+        self.assertIn('4 reports, 2 block names', output)
+        self.assertIn('first > outer > inner', output)
+        self.assertRegex(output, r'\s3 times\s+first > outer\n')
+
+    def test_cli_truncated(self):
+        sink = JSONLinesSink(self.path)
+        self.write_reports(sink, 2)
+        sink.close()
+        with open(self.path, 'a') as f:
+            f.write('[1]\n{"name": "cut", "del')
+
+        skipped = []
+        self.assertEqual(len(list(open_reports(self.path, skipped))), 2)
+        self.assertEqual(skipped, [3, 4])
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            self.assertEqual(main([self.path]), 0)
+        self.assertIn('2 reports, 1 block names', stdout.getvalue())
+        self.assertIn('skipped 2 malformed lines', stderr.getvalue())
+
+    def test_cli_batches(self):
+        sink = JSONLinesSink(self.path)
+        with batch_reports('request', callback=sink, path='/'):
+            self.write_reports(None, 2)
+        sink.close()
+
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            self.assertEqual(main([self.path]), 0)
+        output = stdout.getvalue()
+        self.assertIn('2 reports, 1 block names', output)
+        self.assertIn('block > outer > inner', output)
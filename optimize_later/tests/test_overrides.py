@@ -0,0 +1,162 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from optimize_later import config, overrides
+from optimize_later.core import optimize_later
+from optimize_later.overrides import ConfigWatcher, Overrides, Rule
+
+reported = []
+
+
+def report_callback(report):
+    reported.append(report)
+
+
+class OverridesTest(TestCase):
+    def setUp(self):
+        self.reports = []
+        self.context = config.optimize_context([self.reports.append], reset=True)
+        self.context.__enter__()
+        del reported[:]
+
+    def tearDown(self):
+        self.context.__exit__(None, None, None)
+        config.set_enabled(True)
+        config.set_overrides(None)
+
+    def test_lookup(self):
+        index = Overrides({
+            'app.views:*': {'limit': 1},
+            'app.*': {'limit': 2},
+            'app.views:index': {'limit': 3},
+            'app.[ab]?': {'limit': 4},
+        })
+        self.assertEqual(index.get('app.views:index').limit, 3)
+        self.assertEqual(index.get('app.views:detail').limit, 1)
+        self.assertEqual(index.get('app.models').limit, 2)
+        self.assertEqual(index.get('app.bc').limit, 2)
+        self.assertIsNone(index.get('other'))
+        self.assertIs(index.get('app.views:detail'), index.get('app.views:detail'))
+        self.assertEqual(Overrides({'app.[ab]?': {'limit': 4}}).get('app.bc').limit, 4)
+
+    def test_disabled(self):
+        @optimize_later
+        def function():
+            return 1
+
+        @optimize_later
+        def generator():
+            yield 1
+
+        config.set_enabled(False)
+        with optimize_later() as o:
+            with o.block():
+                pass
+        self.assertEqual(function(), 1)
+        self.assertEqual(list(generator()), [1])
+        self.assertEqual(self.reports, [])
+
+        config.set_enabled(True)
+        function()
+        self.assertEqual(len(self.reports), 1)
+
+    def test_disabled_by_name(self):
+        config.set_overrides(Overrides({'quiet*': {'enabled': False}}))
+        with optimize_later('quiet'):
+            pass
+        with optimize_later('loud'):
+            pass
+        self.assertEqual([report.name for report in self.reports], ['loud'])
+
+    def test_limit(self):
+        config.set_overrides(Overrides({'slow': {'limit': 10}, 'fast': {'limit': 0}}))
+
+        @optimize_later('fast', 10)
+        def fast():
+            pass
+
+        with optimize_later('slow'):
+            pass
+        fast()
+        self.assertEqual([report.name for report in self.reports], ['fast'])
+        self.assertEqual(self.reports[0].limit, 0)
+
+    def test_rename(self):
+        config.set_overrides(Overrides({'quiet': {'enabled': False}, 'slow': {'limit': 10}}))
+        with optimize_later('first', 10) as o:
+            o.rename('slow', 0)
+        with optimize_later('first') as o:
+            o.rename('quiet')
+        with optimize_later('first', 10) as o:
+            o.rename('loud', 0)
+        self.assertEqual([report.name for report in self.reports], ['loud'])
+
+    def test_rename_sample_rate(self):
+        config.set_overrides(Overrides({'never': {'sample_rate': 0}, 'always': {'sample_rate': 1}}))
+        for i in range(5):
+            with optimize_later('first') as o:
+                o.rename('never')
+            with optimize_later('first') as o:
+                o.rename('always')
+        self.assertEqual([report.name for report in self.reports], ['always'] * 5)
+
+    def test_sample_rate(self):
+        config.set_overrides(Overrides({'name': {'sample_rate': 0}}))
+        for i in range(10):
+            with optimize_later('name'):
+                pass
+        self.assertEqual(self.reports, [])
+
+    def test_callbacks(self):
+        config.set_overrides(Overrides({'name': {'callbacks': ['%s.report_callback' % (__name__,)]}}))
+        with optimize_later('name', callback=self.reports.append):
+            pass
+        self.assertEqual(self.reports, [])
+        self.assertEqual(len(reported), 1)
+
+    def test_configure(self):
+        overrides.configure('{"enabled": false}')
+        self.assertFalse(config.get_enabled())
+        self.assertIsNone(config.get_overrides())
+
+        os.environ[overrides.ENVIRONMENT_VARIABLE] = json.dumps({'names': {'name': {'limit': 1}}})
+        try:
+            overrides.configure()
+        finally:
+            del os.environ[overrides.ENVIRONMENT_VARIABLE]
+        self.assertTrue(config.get_enabled())
+        self.assertEqual(config.get_overrides().get('name').limit, 1)
+        self.assertIsNone(overrides.configure())
+
+    def test_watcher(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'config.json')
+
+        def write(content, mtime):
+            with open(path, 'w') as f:
+                f.write(content)
+            os.utime(path, (mtime, mtime))
+
+        write(json.dumps({'names': {'name': {'limit': 1}}}), 1000)
+        watcher = ConfigWatcher(path)
+        self.assertTrue(watcher.check())
+        self.assertFalse(watcher.check())
+        self.assertEqual(config.get_overrides().get('name').limit, 1)
+
+        write(json.dumps({'enabled': False}), 2000)
+        self.assertTrue(watcher.check())
+        self.assertFalse(config.get_enabled())
+        self.assertIsNone(config.get_overrides())
+
+        write('{invalid', 3000)
+        self.assertFalse(watcher.check())
+        self.assertFalse(config.get_enabled())
+
+    def test_rule(self):
+        rule = Rule(callbacks=['%s.report_callback' % (__name__,), self.reports.append])
+        self.assertEqual(rule.callbacks, [report_callback, self.reports.append])
+        self.assertIsNone(Rule().sampler)
@@ -0,0 +1,95 @@
+import threading
+from unittest import TestCase
+
+from optimize_later.batching import batch_reports, ReportBatch
+from optimize_later.core import optimize_later, OptimizeBlock, OptimizeReport
+from optimize_later.recent import RecentReports
+
+
+def make_report(name, delta=1.0, limit=0.5, blocks=None):
+    return OptimizeReport(name, limit, 0, delta, delta, blocks or [])
+
+
+def make_block(name, children=()):
+    block = OptimizeBlock(name)
+    block.start, block.end = 0, 1
+    if children:
+        block._blocks = list(children)
+    return block
+
+
+class RecentReportsTest(TestCase):
+    def test_ring(self):
+        recent = RecentReports(capacity=3)
+        for i in range(5):
+            recent(make_report('report%d' % (i,)))
+        self.assertEqual(recent.count, 3)
+        self.assertEqual([report.name for report in recent.recent()], ['report4', 'report3', 'report2'])
+        recent.clear()
+        self.assertEqual(recent.recent(), [])
+
+    def test_query(self):
+        recent = RecentReports()
+        recent(make_report('app.views:index', 1.0))
+        recent(make_report('app.views:detail', 3.0))
+        recent(make_report('other', 2.0))
+
+        self.assertEqual([report.name for report in recent.recent(name='app.*')],
+                         ['app.views:detail', 'app.views:index'])
+        self.assertEqual([report.name for report in recent.recent(min_overage=1)], ['other', 'app.views:detail'])
+        self.assertEqual([report.name for report in recent.worst(limit=2)], ['app.views:detail', 'other'])
+        self.assertEqual(len(recent.recent(limit=1)), 1)
+
+        timestamp = recent.query(limit=1)[0][0]
+        self.assertEqual(len(recent.query(since=timestamp + 1)), 0)
+        self.assertEqual(len(recent.query(until=timestamp)), 3)
+
+    def test_truncate(self):
+        blocks = [make_block('a', [make_block('a1'), make_block('a2', [make_block('a2x')])]), make_block('b')]
+        original = make_report('big', blocks=blocks)
+        original.stacks = {'stack%d' % (i,): i for i in range(10)}
+
+        recent = RecentReports(max_blocks=3, max_stacks=2)
+        recent(original)
+        report = recent.recent()[0]
+        self.assertEqual(report.truncated_blocks, 2)
+        self.assertEqual([block.name for block in report.blocks], ['a'])
+        self.assertEqual([block.name for block in report.blocks[0].blocks], ['a1', 'a2'])
+        self.assertEqual(report.blocks[0].blocks[1].blocks, [])
+        self.assertEqual(report.stacks, {'stack9': 9, 'stack8': 8})
+
+        self.assertEqual(len(original.blocks), 2)
+        self.assertEqual(len(original.blocks[0].blocks[1].blocks), 1)
+        self.assertEqual(len(original.stacks), 10)
+
+        recent(make_report('small', blocks=[make_block('a')]))
+        self.assertEqual(recent.recent()[0].truncated_blocks, 0)
+
+    def test_batch(self):
+        recent = RecentReports()
+        recent(ReportBatch('request', 1, 0, 2, [make_report('a'), make_report('b')]))
+        self.assertEqual(sorted(report.name for report in recent.recent()), ['a', 'b'])
+
+    def test_threads(self):
+        recent = RecentReports(capacity=50)
+
+        def record():
+            for i in range(1000):
+                recent(make_report('report'))
+
+        threads = [threading.Thread(target=record) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(recent.count, 50)
+
+    def test_as_callback(self):
+        recent = RecentReports()
+        self.assertTrue(recent)
+        with optimize_later('block', callback=recent):
+            pass
+        with batch_reports('request', callback=recent):
+            with optimize_later('inner'):
+                pass
+        self.assertEqual([report.name for report in recent.recent()], ['inner', 'block'])
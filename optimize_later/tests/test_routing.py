@@ -0,0 +1,82 @@
+from unittest import TestCase
+
+from optimize_later import config
+from optimize_later.config import optimize_context
+from optimize_later.core import optimize_later, OptimizeReport
+from optimize_later.routing import CallbackIndex, CallbackList, RoutedCallback, get_index
+
+
+def make_report(name, delta=1, limit=0):
+    return OptimizeReport(name, limit, 0, delta, delta, [])
+
+
+class RoutingTest(TestCase):
+    def test_index(self):
+        index = CallbackIndex([
+            'all',
+            RoutedCallback('exact', 'app.views:index'),
+            RoutedCallback('prefix', 'app.views:*'),
+            RoutedCallback('short prefix', 'app*'),
+            RoutedCallback('glob', '*:index'),
+            RoutedCallback('slow', min_overage=0.5),
+        ])
+        self.assertEqual([callback for callback, min_overage in index.get('app.views:index')],
+                         ['all', 'exact', 'prefix', 'short prefix', 'glob', 'slow'])
+        self.assertEqual([callback for callback, min_overage in index.get('app.models')],
+                         ['all', 'short prefix', 'slow'])
+        self.assertEqual([callback for callback, min_overage in index.get('other:index')],
+                         ['all', 'glob', 'slow'])
+        self.assertIs(index.get('other'), index.get('other'))
+
+        self.assertEqual(list(index.route(make_report('other', 1, 0.6))), ['all'])
+        self.assertEqual(list(index.route(make_report('other', 1, 0.5))), ['all', 'slow'])
+
+    def test_get_index(self):
+        callbacks = CallbackList([1, 2])
+        index = get_index(callbacks)
+        self.assertIs(get_index(callbacks), index)
+        callbacks.append(3)
+        self.assertEqual(list(get_index(callbacks).route(make_report('name'))), [1, 2, 3])
+        del callbacks[0]
+        self.assertEqual(list(get_index(callbacks).route(make_report('name'))), [2, 3])
+        self.assertIsNot(get_index(CallbackList([1, 2])), index)
+        self.assertEqual(list(get_index([[]]).route(make_report('name'))), [[]])
+
+    def test_context_index(self):
+        # The index of a context's callbacks lives with the context, not in a global cache.
+        with optimize_context([1], reset=True):
+            callbacks = config.get_callbacks()
+            self.assertIsInstance(callbacks, CallbackList)
+            self.assertIs(get_index(callbacks), get_index(config.get_callbacks()))
+
+    def test_register(self):
+        reports = []
+        with optimize_context(reset=True):
+            config.register_callback(reports.append, pattern='app.*')
+            config.register_callback(reports.append, min_overage=10)
+
+            @config.register_callback(pattern='other')
+            def other(report):
+                reports.append(('other', report.name))
+
+            for name in ('app.views', 'other', 'unrelated'):
+                with optimize_later(name):
+                    pass
+            self.assertEqual([getattr(report, 'name', report) for report in reports],
+                             ['app.views', ('other', 'other')])
+
+            config.deregister_callback(reports.append)
+            self.assertEqual(config.get_callbacks(), [RoutedCallback(reports.append, min_overage=10),
+                                                      RoutedCallback(other, 'other')])
+            config.deregister_callback(reports.append)
+            config.deregister_callback(other)
+            self.assertEqual(config.get_callbacks(), [])
+            self.assertRaises(ValueError, config.deregister_callback, other)
+
+    def test_routed_call(self):
+        reports = []
+        callback = RoutedCallback(reports.append, 'app.*', 0.5)
+        callback(make_report('app.views', 1))
+        callback(make_report('app.views', 0.1))
+        callback(make_report('other', 1))
+        self.assertEqual([report.name for report in reports], ['app.views'])
@@ -1,14 +1,21 @@
+import asyncio
+import gc
+import sys
 import time
-from unittest import TestCase
+import tracemalloc
+from unittest import TestCase, skipIf
 
-from optimize_later import config
+from optimize_later import config, measure
 from optimize_later.core import optimize_later, OptimizeReport, OptimizeBlock
 from optimize_later.config import optimize_context
+from optimize_later.routing import CallbackList
+from optimize_later.sampling import CountingSampler, RandomSampler
+from optimize_later.throttle import BaseThrottle, TokenBucketThrottle, WindowThrottle
 
 
 class OptimizeContextTest(TestCase):
     def test_optimize_context(self):
-        old_global, config._global_callbacks = config._global_callbacks, []
+        old_global, config._global_callbacks = config._global_callbacks, CallbackList()
 
         config.register_callback(1)
         with optimize_context():
@@ -124,6 +131,11 @@ class OptimizeLaterTest(TestCase):
     def test_default_name(self):
         self.assertIn('.py@', optimize_later().name)
 
+    def test_default_name_cached(self):
+        names = [optimize_later().name for i in range(3)]
+        self.assertEqual(len(set(names)), 1)
+        self.assertNotEqual(names[0], optimize_later().name)
+
     def get_report(self, *args, **kwargs):
         reports = []
         function = kwargs.pop('function', lambda: None)
@@ -185,6 +197,18 @@ class OptimizeLaterTest(TestCase):
         self.assertIn('  - Block', report)
         self.assertEqual(report.count(', children:'), 2)
 
+    def test_many_blocks(self):
+        reports = []
+        with optimize_later(callback=reports.append) as o:
+            for i in range(1000):
+                with o.block('child'):
+                    pass
+        self.assertReport(reports[0], blocks=1000)
+        block = reports[0].blocks[0]
+        self.assertFalse(hasattr(block, '__dict__'))
+        self.assertEqual(block.blocks, [])
+        self.assertEqual(block.delta, block.end - block.start)
+
     def test_decorator(self):
         reports = []
         config.register_callback(reports.append)
@@ -211,6 +235,91 @@ class OptimizeLaterTest(TestCase):
 
         self.assertEqual(len(reports), 0)
 
+    def test_decorator_methods(self):
+        reports = []
+        config.register_callback(reports.append)
+
+        class Test(object):
+            value = 1
+
+            @optimize_later
+            def method(self, x):
+                return self.value + x
+
+            @optimize_later
+            @staticmethod
+            def static(x):
+                return x
+
+            @staticmethod
+            @optimize_later('static_inner')
+            def static_inner(x):
+                return x
+
+            @optimize_later
+            @classmethod
+            def cls(cls, x):
+                return cls.value + x
+
+        self.assertEqual(Test().method(1), 2)
+        self.assertEqual(Test.static(3), 3)
+        self.assertEqual(Test().static(3), 3)
+        self.assertEqual(Test.static_inner(4), 4)
+        self.assertEqual(Test.cls(2), 3)
+        self.assertEqual([report.name for report in reports], [
+            '%s:method' % (__name__,), '%s:static' % (__name__,), '%s:static' % (__name__,),
+            'static_inner', '%s:cls' % (__name__,),
+        ])
+        for report in reports:
+            self.assertReport(report)
+
+    def test_decorator_generator(self):
+        reports = []
+        config.register_callback(reports.append)
+
+        @optimize_later
+        def generator(n):
+            for i in range(n):
+                time.sleep(0.005)
+                yield i
+            return 'done'
+
+        iterator = generator(3)
+        self.assertEqual(reports, [])
+        self.assertEqual(list(iterator), [0, 1, 2])
+        self.assertEqual(len(reports), 1)
+        self.assertGreaterEqual(reports[0].delta, 0.015)
+
+        def delegate():
+            result = yield from generator(1)
+            self.assertEqual(result, 'done')
+        list(delegate())
+        self.assertEqual(len(reports), 2)
+
+    def test_decorator_exception(self):
+        reports = []
+        config.register_callback(reports.append)
+
+        @optimize_later
+        def function():
+            raise ValueError()
+
+        self.assertRaises(ValueError, function)
+        self.assertEqual(len(reports), 1)
+        self.assertReport(reports[0])
+
+    def test_decorator_recorder(self):
+        recorded = []
+        recorder = config.register_recorder(lambda name, delta: recorded.append(name))
+        try:
+            @optimize_later('recorded', float('inf'))
+            def function():
+                pass
+            function()
+        finally:
+            config.deregister_recorder(recorder)
+        self.assertEqual(recorded, ['recorded'])
+
     def test_decorator_custom_name(self):
         reports = []
         config.register_callback(reports.append)
@@ -223,3 +332,403 @@ class OptimizeLaterTest(TestCase):
         self.assertEqual(len(reports), 1)
         self.assertReport(reports[0])
         self.assertEqual(reports[0].name, 'custom_name')
+
+
+class AsyncioTest(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_async_with(self):
+        reports = []
+
+        async def main():
+            async with optimize_later('async', callback=reports.append) as o:
+                with o.block('a'):
+                    await asyncio.sleep(0)
+
+        self.loop.run_until_complete(main())
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0].name, 'async')
+        self.assertEqual(len(reports[0].blocks), 1)
+
+    def test_coroutine_decorator(self):
+        reports = []
+
+        @optimize_context([reports.append], reset=True)
+        @optimize_later
+        async def function():
+            await asyncio.sleep(0.01)
+            return 42
+
+        self.assertTrue(asyncio.iscoroutinefunction(function))
+        self.assertEqual(self.loop.run_until_complete(function()), 42)
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0].name, '%s:function' % (__name__,))
+        self.assertGreaterEqual(reports[0].delta, 0.01)
+
+    @skipIf(config.ContextVar is None, 'contextvars not available')
+    def test_task_isolation(self):
+        seen = {}
+
+        async def task(name):
+            async with optimize_context([name], reset=True):
+                await asyncio.sleep(0)
+                seen[name] = list(config.get_callbacks())
+
+        async def main():
+            await asyncio.gather(task('a'), task('b'))
+
+        self.loop.run_until_complete(main())
+        self.assertEqual(seen, {'a': ['a'], 'b': ['b']})
+
+
+class GeneratorTest(TestCase):
+    def test_active_time(self):
+        reports = []
+
+        @optimize_later(callback=reports.append)
+        def generator():
+            for i in range(3):
+                time.sleep(0.01)
+                yield i
+
+        for item in generator():
+            time.sleep(0.02)
+        self.assertEqual(len(reports), 1)
+        report = reports[0]
+        self.assertEqual(report.generator.items, 3)
+        self.assertGreaterEqual(report.delta, 0.03)
+        self.assertGreaterEqual(report.generator.wall, 0.07)
+        self.assertLess(report.delta, report.generator.wall - 0.03)
+        self.assertGreaterEqual(report.generator.first_item, 0.01)
+        self.assertLess(report.generator.first_item, 0.02)
+        self.assertGreaterEqual(report.generator.slowest_item, 0.01)
+        self.assertIn('3 items', report.short())
+        self.assertEqual(report.to_dict()['generator']['items'], 3)
+
+    def test_close(self):
+        reports = []
+        closed = []
+
+        @optimize_later(callback=reports.append)
+        def generator():
+            try:
+                while True:
+                    yield
+            finally:
+                closed.append(True)
+
+        iterator = generator()
+        next(iterator)
+        next(iterator)
+        self.assertEqual(reports, [])
+        iterator.close()
+        self.assertEqual(closed, [True])
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0].generator.items, 2)
+        iterator.close()
+        self.assertEqual(len(reports), 1)
+
+    def test_exception(self):
+        reports = []
+
+        @optimize_later(callback=reports.append)
+        def generator():
+            yield 1
+            raise ValueError()
+
+        iterator = generator()
+        self.assertEqual(next(iterator), 1)
+        self.assertRaises(ValueError, next, iterator)
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0].generator.items, 1)
+
+    def test_never_started(self):
+        reports = []
+
+        @optimize_later(callback=reports.append)
+        def generator():
+            yield 1
+
+        iterator = generator()
+        iterator.close()
+        del iterator
+        self.assertEqual(reports, [])
+
+    def test_iterate(self):
+        reports = []
+
+        def generator():
+            received = yield 1
+            yield received * 2
+
+        iterator = optimize_later('rows', callback=reports.append).iterate(generator())
+        self.assertEqual(next(iterator), 1)
+        self.assertEqual(iterator.send(21), 42)
+        self.assertEqual(list(iterator), [])
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0].name, 'rows')
+        self.assertEqual(reports[0].generator.items, 2)
+
+        self.assertEqual(list(optimize_later('list', 1, callback=reports.append).iterate([1, 2, 3])), [1, 2, 3])
+        self.assertEqual(len(reports), 1)
+
+    def test_sampled_out(self):
+        sampler = CountingSampler(2)
+        iterable = [1, 2]
+        self.assertIsNot(optimize_later('rows', sampler=sampler).iterate(iterable), iterable)
+        self.assertIs(optimize_later('rows', sampler=sampler).iterate(iterable), iterable)
+
+
+if sys.version_info >= (3, 6):
+    # Asynchronous generator syntax is a SyntaxError on Python 3.5.
+    from optimize_later.tests.async_generators import AsyncGeneratorTest  # noqa: F401
+
+
+class ThrottleTest(TestCase):
+    def setUp(self):
+        self.reports = []
+        self.optimize_context = optimize_context([self.reports.append], reset=True)
+        self.optimize_context.__enter__()
+
+    def tearDown(self):
+        config.set_throttle(None)
+        self.optimize_context.__exit__(None, None, None)
+
+    def run_blocks(self, name, count):
+        for i in range(count):
+            with optimize_later(name):
+                pass
+
+    def test_window_throttle(self):
+        config.set_throttle(WindowThrottle(2, 0.05))
+        self.run_blocks('a', 5)
+        self.run_blocks('b', 1)
+        self.assertEqual([report.name for report in self.reports], ['a', 'a', 'b'])
+
+        time.sleep(0.06)
+        self.run_blocks('a', 1)
+        self.assertEqual(len(self.reports), 4)
+        self.assertEqual(self.reports[-1].suppressed, 3)
+        self.assertIn('[3 similar reports suppressed]', self.reports[-1].short())
+
+    def test_token_bucket_throttle(self):
+        config.set_throttle(TokenBucketThrottle(100, burst=3))
+        self.run_blocks('a', 10)
+        self.assertEqual(len(self.reports), 3)
+        self.assertEqual(self.reports[0].suppressed, 0)
+
+        time.sleep(0.02)
+        self.run_blocks('a', 1)
+        self.assertEqual(len(self.reports), 4)
+        self.assertEqual(self.reports[-1].suppressed, 7)
+
+    def test_abstract(self):
+        self.assertRaises(TypeError, BaseThrottle)
+
+class SamplingTest(TestCase):
+    def setUp(self):
+        self.reports = []
+        self.optimize_context = optimize_context([self.reports.append], reset=True)
+        self.optimize_context.__enter__()
+
+    def tearDown(self):
+        config.set_sampler(None)
+        self.optimize_context.__exit__(None, None, None)
+
+    def test_counting_sampler(self):
+        sampler = CountingSampler(3)
+        self.assertEqual([sampler() for i in range(7)], [True, False, False, True, False, False, True])
+        self.assertAlmostEqual(sampler.rate, 1 / 3.0)
+
+    def test_random_sampler(self):
+        self.assertFalse(any(RandomSampler(0)() for i in range(100)))
+        self.assertTrue(all(RandomSampler(1)() for i in range(100)))
+
+    def test_instance_sampler(self):
+        for i in range(10):
+            with optimize_later('sampled', sampler=CountingSampler(5)) as o:
+                with o.block('a') as b:
+                    with b.block():
+                        pass
+        self.assertEqual(len(self.reports), 10)
+
+        sampler = CountingSampler(5)
+        for i in range(10):
+            with optimize_later('sampled', sampler=sampler) as o:
+                with o.block('a'):
+                    pass
+        self.assertEqual(len(self.reports), 12)
+        self.assertEqual(self.reports[-1].sample_rate, 0.2)
+        self.assertEqual(len(self.reports[-1].blocks), 1)
+
+    def test_global_sampler(self):
+        config.set_sampler(CountingSampler(4))
+
+        @optimize_later
+        def function():
+            return 42
+
+        self.assertEqual([function() for i in range(8)], [42] * 8)
+        self.assertEqual(len(self.reports), 2)
+        self.assertEqual(self.reports[0].sample_rate, 0.25)
+
+    def test_global_sampler_full_path(self):
+        config.set_sampler(CountingSampler(4))
+        config.set_nesting(True)
+        self.addCleanup(config.set_nesting, False)
+
+        @optimize_later
+        def function():
+            return 42
+
+        @optimize_later('measured', cpu=True)
+        def measured():
+            return 42
+
+        self.assertEqual([function() for i in range(8)], [42] * 8)
+        self.assertEqual([measured() for i in range(8)], [42] * 8)
+        self.assertEqual([report.name for report in self.reports], ['%s:function' % (__name__,)] * 2 + ['measured'] * 2)
+        self.assertEqual(self.reports[0].sample_rate, 0.25)
+
+    def test_unsampled_no_timing(self):
+        with optimize_later(sampler=RandomSampler(0)) as o:
+            with o.block():
+                pass
+        self.assertIs(o.start, None)
+        self.assertIs(o.delta, None)
+        self.assertEqual(self.reports, [])
+
+
+class MeasurementsTest(TestCase):
+    def get_report(self, function, **kwargs):
+        reports = []
+        with optimize_later('measured', callback=reports.append, **kwargs) as o:
+            with o.block('child') as b:
+                with b.block('grandchild'):
+                    function()
+        return reports[0]
+
+    def test_default(self):
+        report = self.get_report(lambda: None)
+        self.assertIs(report.cpu_time, None)
+        self.assertIs(report.gc_time, None)
+        self.assertIs(report.memory, None)
+        self.assertIs(report.blocks[0].cpu_time, None)
+        self.assertNotIn('cpu', report.long())
+
+    def test_cpu(self):
+        def spin():
+            # Spin on CPU time rather than wall time, so that being descheduled cannot shorten it.
+            cpu_time = getattr(time, 'thread_time', time.process_time)
+            end = cpu_time() + 0.02
+            while cpu_time() < end:
+                pass
+            time.sleep(0.02)
+
+        report = self.get_report(spin, cpu=True)
+        self.assertGreater(report.cpu_time, 0.01)
+        self.assertLess(report.cpu_time, report.delta)
+        grandchild = report.blocks[0].blocks[0]
+        self.assertGreater(grandchild.cpu_time, 0.01)
+        self.assertIs(grandchild.gc_time, None)
+        self.assertIn('(cpu ', report.short())
+        self.assertIn('cpu_time', report.to_dict()['blocks'][0])
+
+    def test_gc(self):
+        def collect():
+            gc.collect()
+
+        report = self.get_report(collect, gc=True)
+        self.assertGreater(report.gc_time, 0)
+        self.assertLessEqual(report.gc_time, report.delta)
+        self.assertGreater(report.blocks[0].blocks[0].gc_time, 0)
+        self.assertIn('gc ', report.long())
+        self.assertNotIn(measure._gc_callback, gc.callbacks)
+
+    def test_memory(self):
+        kept = []
+        report = self.get_report(lambda: kept.append(bytearray(100000)), memory=True)
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertGreaterEqual(report.memory, 100000)
+        self.assertGreaterEqual(report.blocks[0].memory, 100000)
+        self.assertIn(' bytes', report.short())
+        self.assertIn('memory', report.to_dict())
+
+    def test_memory_already_tracing(self):
+        tracemalloc.start()
+        try:
+            self.get_report(lambda: None, memory=True)
+            self.assertTrue(tracemalloc.is_tracing())
+        finally:
+            tracemalloc.stop()
+
+
+class NestingTest(TestCase):
+    def setUp(self):
+        self.reports = []
+        self.optimize_context = optimize_context([self.reports.append], reset=True)
+        self.optimize_context.__enter__()
+        config.set_nesting(True)
+
+    def tearDown(self):
+        config.set_nesting(False)
+        self.optimize_context.__exit__(None, None, None)
+
+    def test_nested_functions(self):
+        @optimize_later('inner', float('inf'))
+        def inner():
+            with optimize_later('innermost', 0):
+                pass
+
+        @optimize_later('outer', 0)
+        def outer():
+            inner()
+            inner()
+
+        outer()
+        self.assertEqual(len(self.reports), 1)
+        report = self.reports[0]
+        self.assertEqual(report.name, 'outer')
+        self.assertEqual([block.name for block in report.blocks], ['inner', 'inner'])
+        self.assertEqual([block.name for block in report.blocks[0].blocks], ['innermost'])
+        self.assertLessEqual(report.blocks[0].delta, report.delta)
+        self.assertIs(config.get_active(), None)
+
+    def test_nested_in_block(self):
+        with optimize_later('outer') as o:
+            with o.block('block'):
+                with optimize_later('nested') as n:
+                    with n.block('child'):
+                        pass
+            with optimize_later('sibling'):
+                pass
+
+        self.assertEqual(len(self.reports), 1)
+        report = self.reports[0]
+        self.assertEqual([block.name for block in report.blocks], ['block', 'sibling'])
+        nested = report.blocks[0].blocks[0]
+        self.assertEqual(nested.name, 'nested')
+        self.assertEqual(nested.blocks[0].name, 'child')
+        self.assertEqual(nested.delta, n.delta)
+        self.assertEqual(report.long().count(', children:'), 3)
+
+    def test_exception(self):
+        with optimize_later('outer'):
+            try:
+                with optimize_later('inner'):
+                    raise ValueError()
+            except ValueError:
+                pass
+        self.assertEqual([block.name for block in self.reports[0].blocks], ['inner'])
+        self.assertIs(config.get_active(), None)
+
+    def test_disabled(self):
+        config.set_nesting(False)
+        with optimize_later('outer'):
+            with optimize_later('inner'):
+                pass
+        self.assertEqual([report.name for report in self.reports], ['inner', 'outer'])
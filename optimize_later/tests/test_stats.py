@@ -0,0 +1,235 @@
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from unittest import TestCase, skipIf
+
+from optimize_later import config, shm
+from optimize_later.adaptive import AdaptiveLimit
+from optimize_later.shm import SharedStats
+from optimize_later.core import optimize_later
+from optimize_later.stats import LatencyHistogram, StatsAggregator, bucket_index, bucket_bounds, BUCKET_COUNT
+
+
+class LatencyHistogramTest(TestCase):
+    def test_buckets(self):
+        for value in (1e-6, 0.001, 0.0123, 0.5, 1.5, 100):
+            low, high = bucket_bounds(bucket_index(value))
+            self.assertLessEqual(low, value)
+            self.assertLess(value, high)
+            self.assertLess((high - low) / value, 0.07)
+        self.assertEqual(bucket_index(0), 0)
+        self.assertEqual(bucket_index(1e-12), 0)
+        self.assertEqual(bucket_index(1e6), BUCKET_COUNT - 1)
+
+    def test_summary(self):
+        histogram = LatencyHistogram()
+        self.assertEqual(histogram.percentile(99), 0)
+        for i in range(1, 1001):
+            histogram.record(i / 1000.0)
+
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 1000)
+        self.assertAlmostEqual(summary['mean'], 0.5005)
+        self.assertEqual(summary['max'], 1.0)
+        self.assertAlmostEqual(summary['p50'], 0.5, delta=0.05)
+        self.assertAlmostEqual(summary['p90'], 0.9, delta=0.05)
+        self.assertAlmostEqual(summary['p99'], 0.99, delta=0.05)
+
+    def test_merge(self):
+        a, b = LatencyHistogram(), LatencyHistogram()
+        a.record(0.1)
+        b.record(0.2)
+        b.record(0.3)
+        a.merge(b)
+        self.assertEqual(a.count, 3)
+        self.assertEqual(a.max, 0.3)
+        self.assertEqual(sum(a.buckets), 3)
+
+
+class StatsAggregatorTest(TestCase):
+    def setUp(self):
+        self.aggregator = StatsAggregator()
+        config.register_recorder(self.aggregator.record)
+
+    def tearDown(self):
+        config.deregister_recorder(self.aggregator.record)
+
+    def test_record(self):
+        for i in range(5):
+            with optimize_later('fast', float('inf')):
+                pass
+        with optimize_later('other', float('inf')):
+            pass
+
+        self.assertEqual(sorted(self.aggregator.names()), ['fast', 'other'])
+        self.assertEqual(self.aggregator.get('fast').count, 5)
+        self.assertEqual(self.aggregator.get('missing').count, 0)
+
+        summary = self.aggregator.summary()
+        self.assertEqual(summary['other']['count'], 1)
+        self.assertEqual(set(summary['fast']), {'count', 'mean', 'p50', 'p90', 'p99', 'max'})
+
+    def test_snapshot_reset(self):
+        self.aggregator.record('name', 0.1)
+        snapshot = self.aggregator.snapshot(reset=True)
+        self.assertEqual(snapshot['name'].count, 1)
+        self.assertEqual(self.aggregator.names(), [])
+
+        self.aggregator.record('name', 0.1)
+        self.aggregator.reset()
+        self.assertEqual(self.aggregator.snapshot(), {})
+
+
+class AdaptiveLimitTest(TestCase):
+    def test_warmup(self):
+        adaptive = AdaptiveLimit(warmup=10)
+        self.assertEqual([adaptive.observe('a', 0.01) for i in range(10)], [None] * 10)
+        self.assertAlmostEqual(adaptive.observe('a', 0.01), 0.015, delta=0.001)
+
+        adaptive = AdaptiveLimit(warmup=10, ceiling=1)
+        self.assertEqual(adaptive.observe('a', 0.01), 1)
+
+    def test_floor_ceiling(self):
+        adaptive = AdaptiveLimit(warmup=1, floor=0.5, ceiling=2)
+        adaptive.observe('fast', 0.001)
+        adaptive.observe('slow', 10)
+        self.assertEqual(adaptive.get_limit('fast'), 0.5)
+        self.assertEqual(adaptive.get_limit('slow'), 2)
+        self.assertIs(adaptive.get_limit('missing'), None)
+
+    def test_report(self):
+        reports = []
+        adaptive = AdaptiveLimit(warmup=5, factor=1)
+        for i in range(5):
+            with optimize_later('block', adaptive, callback=reports.append):
+                pass
+        self.assertEqual(reports, [])
+
+        with optimize_later('block', adaptive, callback=reports.append):
+            time.sleep(0.01)
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0].limit, adaptive.baselines()['block']['limit'])
+        self.assertLess(reports[0].limit, 0.01)
+
+    def test_window(self):
+        adaptive = AdaptiveLimit(warmup=1, window=10, recompute_every=1)
+        for i in range(20):
+            adaptive.observe('a', 1)
+        for i in range(10):
+            adaptive.observe('a', 0.001)
+        self.assertEqual(adaptive.baselines()['a']['count'], 10)
+        self.assertLess(adaptive.get_limit('a'), 0.01)
+
+    def test_persist(self):
+        adaptive = AdaptiveLimit(warmup=10)
+        for i in range(20):
+            adaptive.observe('a', 0.1)
+
+        path = os.path.join(tempfile.mkdtemp(), 'baselines.json')
+        adaptive.save(path)
+        restored = AdaptiveLimit(warmup=10)
+        restored.restore(path)
+        self.assertEqual(restored.baselines(), adaptive.baselines())
+        self.assertEqual(restored.observe('a', 0.1), adaptive.get_limit('a'))
+        os.unlink(path)
+
+
+def record_shared_stats(path, count):
+    stats = SharedStats(path)
+    for i in range(count):
+        stats.record('shared', 0.001)
+    stats.record('worker-%d' % (os.getpid(),), 0.5)
+
+
+class SharedStatsTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'stats')
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        os.rmdir(self.directory)
+
+    def test_record(self):
+        stats = SharedStats(self.path, workers=4, names=2)
+        config.register_recorder(stats.record)
+        try:
+            with optimize_later('a', float('inf')):
+                pass
+            with optimize_later('a', float('inf')):
+                pass
+            stats.record('b', 0.25)
+            stats.record('c', 0.25)
+        finally:
+            config.deregister_recorder(stats.record)
+
+        self.assertEqual(stats.dropped, 1)
+        snapshot = SharedStats(self.path).snapshot()
+        self.assertEqual(sorted(snapshot), ['a', 'b'])
+        self.assertEqual(snapshot['a'].count, 2)
+        self.assertEqual(snapshot['b'].max, 0.25)
+        self.assertEqual(snapshot['b'].percentile(50), 0.25)
+
+        stats.reset()
+        self.assertEqual(stats.snapshot(), {})
+
+    def test_large_counts(self):
+        stats = SharedStats(self.path)
+        stats.record('a', 0.25)
+        values, buckets = stats._entries['a']
+        buckets[bucket_index(0.25)] = 2 ** 32 - 1
+        stats.record('a', 0.25)
+        self.assertEqual(buckets[bucket_index(0.25)], 2 ** 32)
+
+    def test_threads(self):
+        stats = SharedStats(self.path, workers=2, names=8)
+        entry_views = stats._entry_views
+
+        def slow_entry_views(slot, index):
+            time.sleep(0.01)
+            return entry_views(slot, index)
+        stats._entry_views = slow_entry_views
+
+        threads = [threading.Thread(target=stats.record, args=('name%d' % (i,), 0.25)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        snapshot = SharedStats(self.path).snapshot()
+        self.assertEqual(sorted(snapshot), ['name0', 'name1', 'name2', 'name3'])
+        self.assertEqual([histogram.count for histogram in snapshot.values()], [1] * 4)
+
+    def test_old_version(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'OPTLATR1' + b'\1' * 1000)
+        stats = SharedStats(self.path, workers=2, names=2)
+        self.assertEqual(stats.snapshot(), {})
+        stats.record('a', 0.25)
+        self.assertEqual(SharedStats(self.path).snapshot()['a'].count, 1)
+
+    @skipIf(not hasattr(os, 'fork'), 'requires fork')
+    def test_processes(self):
+        stats = SharedStats(self.path, workers=4)
+        stats.record('shared', 0.001)
+
+        processes = [multiprocessing.Process(target=record_shared_stats, args=(self.path, 100)) for i in range(3)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        summary = SharedStats(self.path).summary()
+        self.assertEqual(summary['shared']['count'], 301)
+        self.assertEqual(len([name for name in summary if name.startswith('worker-')]), 3)
+
+    def test_cli(self):
+        SharedStats(self.path).record('cli-block', 0.1)
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            self.assertEqual(shm.main([self.path]), 0)
+        self.assertIn('cli-block', stdout.getvalue())
@@ -0,0 +1,171 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase, skipIf
+
+from optimize_later.batching import batch_reports
+from optimize_later.core import optimize_later
+from optimize_later.trace import TraceBuffer, TraceFileSink, report_events
+
+
+def make_report(name='report'):
+    reports = []
+    with optimize_later(name, callback=reports.append) as o:
+        with o.block('a') as a:
+            with a.block('b'):
+                pass
+        with o.block('c'):
+            pass
+    return reports[0]
+
+
+class TraceTest(TestCase):
+    def test_report_events(self):
+        report = make_report()
+        events = report_events(report, pid=1)
+        self.assertEqual([event['name'] for event in events], ['report', 'a', 'b', 'c'])
+        for event in events:
+            self.assertEqual(event['ph'], 'X')
+            self.assertEqual(event['pid'], 1)
+            self.assertEqual(event['tid'], threading.get_ident())
+        self.assertEqual(events[0]['ts'], report.start * 1e6)
+        self.assertAlmostEqual(events[0]['dur'], report.delta * 1e6)
+        self.assertEqual(events[0]['args']['limit'], 0)
+        self.assertLessEqual(events[0]['ts'], events[1]['ts'])
+        self.assertLessEqual(events[2]['ts'] + events[2]['dur'], events[1]['ts'] + events[1]['dur'])
+
+    def test_batch_events(self):
+        batches = []
+        with batch_reports('request', callback=batches.append, path='/'):
+            with optimize_later('inner'):
+                pass
+        events = report_events(batches[0])
+        self.assertEqual([event['name'] for event in events], ['request', 'inner'])
+        self.assertEqual(events[0]['args']['path'], '/')
+
+    def test_buffer(self):
+        buffer = TraceBuffer(max_events=6)
+        buffer(make_report('first'))
+        buffer(make_report('second'))
+        self.assertEqual(buffer.count, 6)
+        self.assertEqual(buffer.dropped, 2)
+
+        data = json.loads(json.dumps(buffer.to_dict()))
+        events = data['traceEvents']
+        self.assertEqual(events[0]['ph'], 'M')
+        self.assertEqual(events[0]['args']['name'], threading.current_thread().name)
+        self.assertEqual([event['name'] for event in events[1:]], ['b', 'c', 'second', 'a', 'b', 'c'])
+
+        buffer.clear()
+        self.assertEqual(buffer.count, 0)
+
+    def test_buffer_callback(self):
+        buffer = TraceBuffer()
+        self.assertTrue(buffer)
+        with optimize_later('block', callback=buffer):
+            pass
+        self.assertEqual(buffer.count, 1)
+
+        buffer = TraceBuffer()
+        with batch_reports('request', callback=buffer):
+            with optimize_later('inner'):
+                pass
+        self.assertEqual([event['name'] for event in buffer.to_dict()['traceEvents'] if event['ph'] == 'X'],
+                         ['request', 'inner'])
+
+    def test_buffer_metadata(self):
+        buffer = TraceBuffer(max_events=1)
+        buffer._names.max_threads = 2
+        for tid in range(10):
+            report = make_report()
+            report.blocks, report.thread = [], threading.get_ident() if tid == 9 else tid + 1
+            buffer(report)
+        self.assertLessEqual(len(buffer._names.names), 2)
+        metadata = [event for event in buffer.to_dict()['traceEvents'] if event['ph'] == 'M']
+        self.assertEqual([event['tid'] for event in metadata], [threading.get_ident()])
+
+        buffer.clear()
+        self.assertEqual(buffer.to_dict()['traceEvents'], [])
+        self.assertEqual(buffer._names.names, {})
+
+    def test_file_sink(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'trace.json')
+
+        sink = TraceFileSink(path, flush_interval=3600)
+        sink(make_report('first'))
+        with open(path) as f:
+            partial = f.read()
+        self.assertTrue(partial.startswith('['))
+        self.assertEqual(len(json.loads(partial + ']')), 5)
+
+        sink(make_report('second'))
+        sink.close()
+        sink(make_report('ignored'))
+        with open(path) as f:
+            events = json.load(f)
+        self.assertEqual([event['name'] for event in events if event['ph'] == 'X'],
+                         ['first', 'a', 'b', 'c', 'second', 'a', 'b', 'c'])
+
+    def test_file_sink_timer(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'trace.json')
+
+        sink = TraceFileSink(path, flush_interval=0.05)
+        self.addCleanup(sink.close)
+        sink(make_report('first'))
+        sink(make_report('second'))
+        self.assertEqual(len(sink._buffer), 4)
+        deadline = time.time() + 5
+        while sink._buffer and time.time() < deadline:
+            time.sleep(0.01)
+        with open(path) as f:
+            self.assertEqual(len(json.loads(f.read() + ']')), 9)
+
+    def test_file_sink_empty(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'trace.json')
+
+        sink = TraceFileSink(path)
+        sink.flush()
+        sink.close()
+        self.assertFalse(os.path.exists(path))
+
+    @skipIf(not hasattr(os, 'fork'), 'requires fork')
+    def test_file_sink_fork(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        shared = TraceFileSink(os.path.join(directory, 'shared.json'), flush_interval=3600)
+        per_pid = TraceFileSink(os.path.join(directory, 'trace.{pid}.json'), flush_interval=3600)
+        for sink in (shared, per_pid):
+            sink(make_report('parent'))
+
+        pid = os.fork()
+        if not pid:
+            try:
+                for sink in (shared, per_pid):
+                    sink(make_report('child'))
+                    sink.close()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        for sink in (shared, per_pid):
+            sink.close()
+
+        def names(name):
+            with open(os.path.join(directory, name)) as f:
+                return [event['name'] for event in json.load(f) if event['ph'] == 'X']
+        self.assertEqual(names('shared.json'), ['parent', 'a', 'b', 'c'])
+        self.assertEqual(names('trace.%d.json' % (os.getpid(),)), ['parent', 'a', 'b', 'c'])
+        self.assertEqual(names('trace.%d.json' % (pid,)), ['child', 'a', 'b', 'c'])
+
+    def test_in_progress(self):
+        report = make_report()
+        report.end = None
+        self.assertEqual(report_events(report), [])
@@ -0,0 +1,158 @@
+import threading
+import time
+from time import perf_counter
+from unittest import TestCase
+
+from optimize_later import config
+from optimize_later.config import optimize_context
+from optimize_later.core import optimize_later
+from optimize_later.profiler import StackProfiler
+from optimize_later.watchdog import Watchdog
+
+
+class WatchdogTest(TestCase):
+    def test_schedule(self):
+        watchdog = Watchdog()
+        fired = threading.Event()
+        seen = []
+        now = perf_counter()
+        watchdog.schedule(now + 0.1, seen.append, 2)
+        watchdog.schedule(now + 0.05, seen.append, 1)
+        watchdog.schedule(now + 0.15, fired.set)
+        cancelled = watchdog.schedule(now + 0.075, seen.append, 'cancelled')
+        watchdog.cancel(cancelled)
+        self.assertTrue(fired.wait(5))
+        self.assertEqual(seen, [1, 2])
+        self.assertEqual(watchdog.pending, 0)
+
+    def test_compact(self):
+        watchdog = Watchdog()
+        timers = [watchdog.schedule(perf_counter() + 3600, len, ()) for i in range(200)]
+        for timer in timers:
+            watchdog.cancel(timer)
+        self.assertLess(len(watchdog._heap), 200)
+        self.assertEqual(watchdog.pending, 0)
+
+    def test_cancel_twice(self):
+        watchdog = Watchdog()
+        timer = watchdog.schedule(perf_counter() + 3600, len, ())
+        watchdog.schedule(perf_counter() + 3600, len, ())
+        watchdog.cancel(timer)
+        watchdog.cancel(timer)
+        self.assertEqual(watchdog._cancelled, 1)
+        self.assertEqual(watchdog.pending, 1)
+
+
+class InProgressReportTest(TestCase):
+    def setUp(self):
+        self.reports = []
+        self.reported = threading.Event()
+        self.optimize_context = optimize_context([self.reports.append], reset=True)
+        self.optimize_context.__enter__()
+        config.set_watchdog(Watchdog())
+
+    def tearDown(self):
+        config.set_watchdog(None)
+        self.optimize_context.__exit__(None, None, None)
+
+    def wait_for_report(self, count):
+        deadline = time.time() + 5
+        while len(self.reports) < count and time.time() < deadline:
+            time.sleep(0.001)
+
+    def slow_function(self):
+        self.wait_for_report(1)
+
+    def test_in_progress(self):
+        with optimize_later('slow', 0.01) as o:
+            with o.block('child'):
+                self.slow_function()
+
+        self.assertEqual(len(self.reports), 2)
+        in_progress, complete = self.reports
+        self.assertTrue(in_progress.in_progress)
+        self.assertIs(in_progress.end, None)
+        self.assertGreaterEqual(in_progress.delta, 0.01)
+        self.assertIn('slow_function', ''.join(in_progress.stack))
+        self.assertIn('still running after', in_progress.short())
+        self.assertIn("Block 'child' still running", in_progress.long())
+        self.assertIn('Stack:', in_progress.long())
+
+        self.assertFalse(complete.in_progress)
+        self.assertIs(complete.in_progress_report, in_progress)
+        self.assertIs(complete.stack, None)
+
+    def test_fast(self):
+        with optimize_later('fast', 10):
+            pass
+        self.assertEqual(self.reports, [])
+        self.assertEqual(config.get_watchdog().pending, 0)
+
+    def test_rename(self):
+        with optimize_later('unresolved', 0.05) as o:
+            o.rename('slow_view', 10)
+            time.sleep(0.1)
+        self.assertEqual(self.reports, [])
+
+        with optimize_later('unresolved', 10) as o:
+            o.rename('fast_view', 0.01)
+            self.slow_function()
+        self.assertEqual([(report.name, report.limit, report.in_progress) for report in self.reports],
+                         [('fast_view', 0.01, True), ('fast_view', 0.01, False)])
+
+
+class StackProfilerTest(TestCase):
+    def setUp(self):
+        self.reports = []
+        self.optimize_context = optimize_context([self.reports.append], reset=True)
+        self.optimize_context.__enter__()
+        config.set_profiler(StackProfiler(interval=0.001, threshold=0.5))
+
+    def tearDown(self):
+        config.set_profiler(None)
+        self.optimize_context.__exit__(None, None, None)
+
+    def spin(self, timer, seconds):
+        # Spin until the profiler has sampled this frame and the block has run for at least seconds, so that
+        # samples cannot miss spin() when the machine is loaded.
+        deadline = perf_counter() + 5
+        while (not timer._profile.samples or perf_counter() - timer.start < seconds) and perf_counter() < deadline:
+            pass
+
+    def test_slow(self):
+        with optimize_later('slow', 0.02) as o:
+            self.spin(o, 0.03)
+
+        self.assertEqual(len(self.reports), 1)
+        stacks = self.reports[0].stacks
+        self.assertTrue(stacks)
+        self.assertTrue(any(stack.endswith('test_watchdog.py:spin') for stack in stacks))
+        for line in self.reports[0].collapsed().splitlines():
+            stack, count = line.rsplit(' ', 1)
+            self.assertIn(';', stack)
+            self.assertGreater(int(count), 0)
+
+    def test_fast(self):
+        with optimize_later('fast', 10) as o:
+            pass
+        self.assertIs(o._profile.stacks, None)
+        self.assertEqual(config.get_profiler().watchdog.pending, 0)
+
+    def test_under_limit(self):
+        with optimize_later('under', 0.4) as o:
+            self.spin(o, 0)
+        self.assertEqual(self.reports, [])
+        self.assertTrue(o._profile.stacks)
+        self.assertEqual(config.get_profiler()._sessions, [])
+
+    def test_watchdog(self):
+        watchdog = Watchdog()
+        self.assertTrue(watchdog)
+        self.assertIs(StackProfiler(watchdog=watchdog).watchdog, watchdog)
+
+    def test_rename(self):
+        with optimize_later('unresolved', 0.02) as o:
+            o.rename('view', 10)
+            time.sleep(0.05)
+        self.assertIs(o._profile.stacks, None)
+        self.assertEqual(config.get_profiler().watchdog.pending, 0)
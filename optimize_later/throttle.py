@@ -0,0 +1,90 @@
+from abc import ABCMeta, abstractmethod
+from time import monotonic
+
+from optimize_later.utils import with_metaclass
+
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
+
+class BaseThrottle(with_metaclass(ABCMeta)):
+    """Decides, per block name, whether a slow report should be emitted.
+
+    acquire(name) returns None if the report should be suppressed, otherwise the number of reports
+    suppressed for that name since the last one emitted. Subclasses keep a list per name, made by
+    _new_state() and ending with the suppressed count, and decide with _allow(state).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = {}
+
+    def acquire(self, name):
+        with self._lock:
+            state = self._state.get(name)
+            if state is None:
+                state = self._state[name] = self._new_state()
+            if not self._allow(state):
+                state[-1] += 1
+                return None
+            suppressed, state[-1] = state[-1], 0
+            return suppressed
+
+    def reset(self):
+        with self._lock:
+            self._state = {}
+
+    @abstractmethod
+    def _new_state(self):
+        pass
+
+    @abstractmethod
+    def _allow(self, state):
+        pass
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Allows bursts of up to `burst` reports per name, refilling at `rate` reports per second."""
+
+    def __init__(self, rate, burst=1):
+        super(TokenBucketThrottle, self).__init__()
+        self.rate = rate
+        self.burst = burst
+
+    def _new_state(self):
+        # [tokens, last refill, suppressed]
+        return [self.burst, monotonic(), 0]
+
+    def _allow(self, state):
+        now = monotonic()
+        state[0] = min(self.burst, state[0] + (now - state[1]) * self.rate)
+        state[1] = now
+        if state[0] < 1:
+            return False
+        state[0] -= 1
+        return True
+
+
+class WindowThrottle(BaseThrottle):
+    """Allows the first `count` reports per name in every `window` seconds."""
+
+    def __init__(self, count, window):
+        super(WindowThrottle, self).__init__()
+        self.count = count
+        self.window = window
+
+    def _new_state(self):
+        # [window start, reports in window, suppressed]
+        return [monotonic(), 0, 0]
+
+    def _allow(self, state):
+        now = monotonic()
+        if now - state[0] >= self.window:
+            state[0] = now
+            state[1] = 0
+        if state[1] >= self.count:
+            return False
+        state[1] += 1
+        return True
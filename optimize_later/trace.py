@@ -0,0 +1,266 @@
+"""Export reports as Chrome Trace Event JSON, to view block trees as a timeline in Perfetto or chrome://tracing.
+
+Each report and block becomes a complete ("X") event on the track of the thread that ran it, with
+timestamps from perf_counter in microseconds. Use TraceBuffer to keep the most recent events in memory, or
+TraceFileSink to stream every report into one trace file.
+"""
+import atexit
+import json
+import logging
+import os
+import weakref
+from collections import deque
+from time import monotonic
+
+from optimize_later.utils import register_after_fork
+
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
+log = logging.getLogger(__name__.rpartition('.')[0] or __name__)
+
+_sinks = weakref.WeakSet()
+
+
+def _block_events(block, pid, tid, events):
+    if block.start is None or block.end is None:
+        return
+    args = {}
+    if block._measurements is not None:
+        args.update(block._measurements.to_dict())
+    # Query blocks from the Django middleware cover many executions of one query.
+    if hasattr(block, 'sql'):
+        args.update(sql=block.sql, count=block.count, total=block.total)
+    events.append({
+        'name': block.name, 'cat': 'block', 'ph': 'X', 'pid': pid, 'tid': tid,
+        'ts': block.start * 1e6, 'dur': (block.end - block.start) * 1e6, 'args': args,
+    })
+    for child in block._blocks or ():
+        _block_events(child, pid, tid, events)
+
+
+def report_events(report, pid=None):
+    """Return the trace events for a report, or a ReportBatch, and its blocks. In-progress reports are skipped.
+
+    Reports are placed on the track of report.thread. pid defaults to the current process.
+    """
+    pid = os.getpid() if pid is None else pid
+    events = []
+    reports = getattr(report, 'reports', None)
+    if reports is not None:
+        # A batch spans the reports made during its unit of work, e.g. a request.
+        args = dict(report.annotations, delta=report.delta, reports=len(reports))
+        events.append({
+            'name': report.name, 'cat': 'batch', 'ph': 'X', 'pid': pid, 'tid': reports[0].thread or 0,
+            'ts': report.start * 1e6, 'dur': report.delta * 1e6, 'args': args,
+        })
+        for child in reports:
+            events += report_events(child, pid)
+        return events
+
+    if report.end is None:
+        return events
+    args = {'limit': report.limit, 'delta': report.delta}
+    if report.suppressed:
+        args['suppressed'] = report.suppressed
+    if report.sample_rate != 1:
+        args['sample_rate'] = report.sample_rate
+    if report._measurements is not None:
+        args.update(report._measurements.to_dict())
+    if report.generator is not None:
+        args.update(report.generator.to_dict())
+    tid = report.thread or 0
+    events.append({
+        'name': report.name, 'cat': 'report', 'ph': 'X', 'pid': pid, 'tid': tid,
+        'ts': report.start * 1e6, 'dur': (report.end - report.start) * 1e6, 'args': args,
+    })
+    for block in report.blocks:
+        _block_events(block, pid, tid, events)
+    return events
+
+
+def thread_name_event(tid, pid=None):
+    """Return the metadata event naming the track of a thread, if it is still running."""
+    for thread in threading.enumerate():
+        if thread.ident == tid:
+            return {'name': 'thread_name', 'ph': 'M', 'pid': os.getpid() if pid is None else pid, 'tid': tid,
+                    'args': {'name': thread.name}}
+    return None
+
+
+class _ThreadNames(object):
+    # Threads come and go, so the names are forgotten all at once past max_threads, and named again if seen.
+    def __init__(self, max_threads=4096):
+        self.max_threads = max_threads
+        self.names = {}
+
+    def events(self, events):
+        # Name each thread track the first time it appears.
+        result = []
+        for event in events:
+            key = event['pid'], event['tid']
+            if key not in self.names:
+                if len(self.names) >= self.max_threads:
+                    self.names.clear()
+                name = self.names[key] = thread_name_event(event['tid'], event['pid'])
+                if name is not None:
+                    result.append(name)
+        return result
+
+
+class TraceBuffer(object):
+    """A callback keeping the trace events of the most recent reports, up to max_events events.
+
+    Older events are dropped first, counted in self.dropped. Export with to_dict() or dump(file).
+    """
+
+    def __init__(self, max_events=100000):
+        self.max_events = max_events
+        self.dropped = 0
+        self._events = deque(maxlen=max_events)
+        self._names = _ThreadNames()
+        self._lock = threading.Lock()
+
+    def __call__(self, report):
+        events = report_events(report)
+        with self._lock:
+            self._names.events(events)
+            self.dropped += max(len(self._events) + len(events) - self.max_events, 0)
+            self._events.extend(events)
+
+    @property
+    def count(self):
+        """The number of events kept. Not __len__, so that an empty buffer is still a true callback."""
+        return len(self._events)
+
+    def to_dict(self):
+        with self._lock:
+            events = list(self._events)
+            # Only name the tracks of threads with events still in the buffer.
+            tracks = {(event['pid'], event['tid']) for event in events}
+            metadata = [name for key, name in self._names.names.items() if name is not None and key in tracks]
+        return {'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}
+
+    def dump(self, file):
+        json.dump(self.to_dict(), file, separators=(',', ':'), default=repr)
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+            self._names = _ThreadNames()
+            self.dropped = 0
+
+
+class TraceFileSink(object):
+    """A callback streaming every report into one trace file, in the JSON array format.
+
+    Events are buffered, up to buffer_events of them, and written at least every flush_interval seconds, by a
+    timer thread if no other report comes, and at exit.
+    The closing bracket is written by close(), but trace viewers also accept the file without it, so it can
+    be opened while still being written. The file is only created once there are events to write.
+
+    Each process needs its own file, so in pre-fork servers, put {pid} in the path, which is replaced with the
+    process id when the file is opened. Without it, forked children ignore reports instead of overwriting
+    the trace of their parent.
+    """
+
+    def __init__(self, path, buffer_events=1000, flush_interval=1):
+        self.path = path
+        self.buffer_events = buffer_events
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._closed = False
+        self._empty = True
+        self._buffer = []
+        self._flushed = None
+        self._names = _ThreadNames()
+        self._timer = None
+        self._forked = False
+        self._encoder = json.JSONEncoder(separators=(',', ':'), default=repr)
+        _sinks.add(self)
+        self._pid = os.getpid()
+        self._check_pid = not register_after_fork(self, TraceFileSink._after_fork)
+
+    def __call__(self, report):
+        if self._check_pid and self._pid != os.getpid():
+            self._after_fork()
+        events = report_events(report)
+        with self._lock:
+            if self._closed:
+                return
+            if self._forked and '{pid}' not in self.path:
+                log.warning('Ignoring reports in forked process %d, as trace path %r has no {pid}',
+                            os.getpid(), self.path)
+                self._closed = True
+                return
+            self._buffer += self._names.events(events)
+            self._buffer += events
+            if len(self._buffer) >= self.buffer_events or self._flushed is None or \
+                    monotonic() - self._flushed >= self.flush_interval:
+                self._write()
+            elif self._buffer and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval - (monotonic() - self._flushed), self._flush_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_timer(self):
+        with self._lock:
+            self._timer = None
+            if not self._closed and self._buffer:
+                self._write()
+
+    def _after_fork(self):
+        # The file, buffered events and timer belong to the parent, and the timer thread does not survive fork.
+        self._lock = threading.Lock()
+        self._file = None
+        self._empty = True
+        self._buffer = []
+        self._flushed = None
+        self._names = _ThreadNames()
+        self._timer = None
+        self._pid = os.getpid()
+        self._forked = True
+
+    def _write(self):
+        if self._file is None:
+            if not self._buffer:
+                return
+            self._file = open(self.path.replace('{pid}', str(os.getpid())), 'w', encoding='utf-8')
+            self._file.write('[')
+        for event in self._buffer:
+            self._file.write('\n' if self._empty else ',\n')
+            self._file.write(self._encoder.encode(event))
+            self._empty = False
+        self._file.flush()
+        self._buffer = []
+        self._flushed = monotonic()
+
+    def flush(self):
+        with self._lock:
+            if not self._closed:
+                self._write()
+
+    def close(self):
+        """Write the remaining events and finish the trace. Reports made afterwards are ignored."""
+        with self._lock:
+            if self._closed:
+                return
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._write()
+            if self._file is not None:
+                self._file.write('\n]\n')
+                self._file.close()
+                self._file = None
+            self._closed = True
+
+
+@atexit.register
+def flush_sinks():
+    for sink in list(_sinks):
+        sink.flush()
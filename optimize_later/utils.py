@@ -1,11 +1,14 @@
+import os
+import weakref
 from types import FunctionType
 
 
 class NoArgDecoratorMeta(type):
     def __call__(cls, *args, **kwargs):
-        if len(args) == 1 and isinstance(args[0], FunctionType):
+        if len(args) == 1 and isinstance(args[0], (FunctionType, staticmethod, classmethod)):
             return cls()(args[0])
-        return super(NoArgDecoratorMeta, cls).__call__(*args, **kwargs)
+        # type.__call__ directly, as super() costs a noticeable share of constructing a small object.
+        return type.__call__(cls, *args, **kwargs)
 
 
 # Borrowed from the six library.
@@ -20,3 +23,22 @@ def with_metaclass(meta, *bases):
             return meta(name, bases, d)
 
     return type.__new__(metaclass, 'temporary_class', (), {})
+
+
+def register_after_fork(instance, function):
+    """Call function(instance) in forked children, for as long as instance is alive.
+
+    Returns False on Python versions without os.register_at_fork, where callers must check os.getpid().
+    """
+    if not hasattr(os, 'register_at_fork'):
+        return False
+
+    reference = weakref.ref(instance)
+
+    def after_in_child():
+        instance = reference()
+        if instance is not None:
+            function(instance)
+
+    os.register_at_fork(after_in_child=after_in_child)
+    return True
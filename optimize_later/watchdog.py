@@ -0,0 +1,106 @@
+import heapq
+import logging
+import os
+from itertools import count
+from time import perf_counter
+
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
+log = logging.getLogger(__name__.rpartition('.')[0] or __name__)
+
+
+class WatchdogTimer(object):
+    __slots__ = ('deadline', 'sequence', 'function', 'args')
+
+    def __init__(self, deadline, sequence, function, args):
+        self.deadline = deadline
+        self.sequence = sequence
+        self.function = function
+        self.args = args
+
+    def __lt__(self, other):
+        return (self.deadline, self.sequence) < (other.deadline, other.sequence)
+
+    def cancel(self):
+        self.function = None
+        self.args = None
+
+
+class Watchdog(object):
+    """Runs functions on a background thread once their perf_counter() deadline passes.
+
+    Timers are kept in a heap. Cancelled timers are removed lazily, and the heap is rebuilt when
+    they make up more than half of it, so timers cancelled long before their deadline do not pile up.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._cancelled = 0
+        self._sequence = count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+        self._pid = None
+
+    def schedule(self, deadline, function, *args):
+        timer = WatchdogTimer(deadline, next(self._sequence), function, args)
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._start()
+            heapq.heappush(self._heap, timer)
+            if self._heap[0] is timer:
+                self._wakeup.notify()
+        return timer
+
+    def cancel(self, timer):
+        # Under the lock, as the watchdog thread cancels timers as it fires them.
+        with self._lock:
+            if timer.function is None:
+                return
+            timer.cancel()
+            self._cancelled += 1
+            if self._cancelled > 64 and self._cancelled * 2 > len(self._heap):
+                self._heap = [timer for timer in self._heap if timer.function is not None]
+                heapq.heapify(self._heap)
+                self._cancelled = 0
+
+    @property
+    def pending(self):
+        """The number of timers scheduled and neither fired nor cancelled."""
+        with self._lock:
+            return sum(1 for timer in self._heap if timer.function is not None)
+
+    def _start(self):
+        # Threads do not survive fork(), so pre-fork servers need a new thread in each child.
+        self._pid = os.getpid()
+        self._heap = []
+        self._cancelled = 0
+        self._thread = threading.Thread(target=self._run, name='optimize-later-watchdog')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                heap = self._heap
+                while heap and heap[0].function is None:
+                    heapq.heappop(heap)
+                    self._cancelled = max(self._cancelled - 1, 0)
+                if not heap:
+                    self._wakeup.wait()
+                    continue
+                timeout = heap[0].deadline - perf_counter()
+                if timeout > 0:
+                    self._wakeup.wait(timeout)
+                    continue
+                timer = heapq.heappop(heap)
+                function, args = timer.function, timer.args
+                timer.cancel()
+
+            try:
+                function(*args)
+            except Exception:
+                log.exception('Failed to invoke watchdog function: %r', function)
@@ -48,6 +48,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'optimize_later.middleware.OptimizeLaterMiddleware',
 ]
 
 ROOT_URLCONF = 'testproject.urls'
@@ -0,0 +1,10 @@
+from django.contrib.auth.models import Group, User
+from django.http import HttpResponse
+
+
+def queries(request):
+    # Deliberate N+1 pattern.
+    names = []
+    for user in User.objects.all():
+        names.extend(group.name for group in Group.objects.filter(user=user))
+    return HttpResponse(', '.join(names))